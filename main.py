@@ -1,10 +1,16 @@
-import threading
 import os
 import asyncio
+import random
 import time
 import fcntl
+import logging
+from asgiref.wsgi import WsgiToAsgi
 from flask import Flask
 from telegram_cleanup.bot_interface import start_bot
+from telegram_cleanup.config import configure_logging, run_async
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -13,14 +19,31 @@ bot_status = {
     "initialized": False,
     "last_error": None,
     "start_time": None,
-    "thread_alive": False
+    "_version": 0 # Bumped on every change so the health page is re-rendered only then
 }
+_health_cache = {"version": -1, "body": b""}
 
-@app.route('/')
-def health_check():
+def set_status(**changes):
+    """Updates bot_status and invalidates the cached health page."""
+    bot_status.update(changes)
+    bot_status["_version"] += 1
+
+LOCK_FILE = os.path.join("sessions", "bot.lock")
+
+def lock_owner_pid():
+    """Returns the PID recorded by the process holding the bot lock, or None."""
+    try:
+        with open(LOCK_FILE) as f:
+            return int(f.read().strip() or 0) or None
+    except (OSError, ValueError):
+        return None
+
+def render_health():
     status_str = "🟢 Bot is Running" if bot_status["initialized"] else "🔴 Bot is Starting..."
     if bot_status["last_error"]:
         status_str = f"⚠️ Bot Error: {bot_status['last_error']}"
+    if bot_process_lock is None:
+        status_str = "💤 Standby (bot runs in another worker)"
 
     return f"""
     <html>
@@ -33,75 +56,118 @@ def health_check():
             <p>To test, send <code>/ping</code> to your bot on Telegram.</p>
         </body>
     </html>
-    """, 200
+    """
 
-def run_bot_in_thread():
-    """Starts the Telethon bot in a separate asyncio event loop with retry logic."""
-    global bot_status
-    bot_status["thread_alive"] = True
-    bot_status["start_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+@app.route('/')
+def health_check():
+    # Liveness probes hit this often; serve pre-encoded bytes until the status changes
+    if _health_cache["version"] != bot_status["_version"]:
+        _health_cache["body"] = render_health().encode()
+        _health_cache["version"] = bot_status["_version"]
+    return _health_cache["body"], 200, {"Content-Type": "text/html; charset=utf-8"}
+
+@app.route('/lock-status')
+def lock_status():
+    owner = lock_owner_pid()
+    return {"pid": os.getpid(), "owner_pid": owner, "is_bot_worker": owner == os.getpid()}, 200
 
-    print("🧵 [Thread] Starting asyncio loop...")
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+async def run_bot():
+    """Runs the Telethon bot forever on the current event loop with retry logic."""
+    set_status(start_time=time.strftime("%Y-%m-%d %H:%M:%S"))
 
     retry_delay = 5
     while True:
+        started_at = time.monotonic()
         try:
-            print(f"🤖 [Thread] Attempting to start_bot()...")
-            bot_status["initialized"] = False
+            logger.info("🤖 [Bot] Attempting to start_bot()...")
+            set_status(initialized=False)
 
             def on_start_callback():
-                print("📝 [Thread] Bot signaled 'started' via callback.")
-                bot_status["initialized"] = True
-                bot_status["last_error"] = None
+                logger.info("📝 [Bot] Bot signaled 'started' via callback.")
+                set_status(initialized=True, last_error=None)
 
             # This will block until the bot is disconnected
-            loop.run_until_complete(start_bot(on_start=on_start_callback))
+            await start_bot(on_start=on_start_callback)
 
-            print("🤖 [Thread] Bot disconnected normally.")
-            bot_status["last_error"] = "Disconnected"
+            logger.info("🤖 [Bot] Bot disconnected normally.")
+            set_status(last_error="Disconnected")
         except Exception as e:
             error_msg = str(e)
-            print(f"❌ [Thread] Fatal Bot Error: {error_msg}")
-            bot_status["last_error"] = error_msg
+            logger.error("❌ [Bot] Fatal Bot Error: %s", error_msg)
+            set_status(last_error=error_msg)
 
-        print(f"🔄 [Thread] Retrying in {retry_delay}s...")
-        time.sleep(retry_delay)
-        retry_delay = min(retry_delay * 2, 60) # Exponential backoff
+        # A run that stayed up for a while was healthy, so start the backoff over
+        if bot_status["initialized"] and time.monotonic() - started_at >= 60:
+            retry_delay = 5
 
-# Start the bot thread immediately when the module is loaded (for Gunicorn)
-# We use a robust file lock to ensure only ONE Gunicorn worker process runs the bot.
-def try_start_bot():
-    lock_file = os.path.join("sessions", "bot.lock")
+        # Jitter keeps several workers from reconnecting to Telegram in lockstep
+        delay = retry_delay + random.uniform(0, retry_delay * 0.25)
+        logger.info("🔄 [Bot] Retrying in %.0fs...", delay)
+        await asyncio.sleep(delay)
+        retry_delay = min(retry_delay * 2, 300) # Exponential backoff
+
+def acquire_bot_lock():
+    """Takes the bot file lock so only ONE worker process runs the bot. Returns the open lock file or None."""
     try:
         # Create sessions dir if not exists
         os.makedirs("sessions", exist_ok=True)
 
-        # Open lock file
-        f = open(lock_file, "w")
+        # Open without truncating so a busy lock keeps its owner's PID
+        f = open(LOCK_FILE, "a")
         # Try to acquire an exclusive lock (non-blocking)
         fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
-
-        # If we got here, we have the lock!
-        if os.environ.get("BOT_STARTED") != "true":
-            os.environ["BOT_STARTED"] = "true"
-            t = threading.Thread(target=run_bot_in_thread, daemon=True)
-            t.start()
-            print(f"🛰️  [Main] Bot thread dispatched in this process (Lock acquired).")
-            # We keep 'f' open to maintain the lock
-            return f
+        f.truncate(0)
+
+        # If we got here, we have the lock! Record who owns it for the health check
+        f.write(f"{os.getpid()}\n")
+        f.flush()
+        logger.info("🛰️  [Main] Bot will run in this process (Lock acquired).")
+        # The caller keeps 'f' open to maintain the lock; it is released if the worker dies
+        return f
     except (IOError, BlockingIOError):
-        print(f"🛰️  [Main] Bot already running in another process (Lock busy).")
+        logger.info("🛰️  [Main] Bot already running in another process (Lock busy).")
     except Exception as e:
-        print(f"⚠️  [Main] Lock error: {e}")
+        logger.warning("⚠️  [Main] Lock error: %s", e)
     return None
 
+_wsgi_app = WsgiToAsgi(app)
+bot_task = None
 # Global lock object to prevent garbage collection
-bot_process_lock = try_start_bot()
+bot_process_lock = None
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point: serves the health check and runs the bot as a task on the server's loop."""
+    global bot_task, bot_process_lock
+    if scope["type"] != "lifespan":
+        await _wsgi_app(scope, receive, send)
+        return
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            bot_process_lock = acquire_bot_lock()
+            set_status() # Ownership decides between running and standby
+            if bot_process_lock:
+                bot_task = asyncio.create_task(run_bot())
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if bot_task:
+                bot_task.cancel()
+                # Let the bot's cleanup (disconnect, finally blocks) run before the server exits
+                await asyncio.wait({bot_task})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def serve(port):
+    """Serves the health check and runs the bot on a single event loop."""
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config
+
+    hypercorn_config = Config()
+    hypercorn_config.bind = [f"0.0.0.0:{port}"]
+    await hypercorn_serve(asgi_app, hypercorn_config)
 
 if __name__ == "__main__":
-    # For local testing
     port = int(os.environ.get("PORT", 8000))
-    print(f"🌐 [Main] Starting web server on port {port}...")
-    app.run(host='0.0.0.0', port=port)
+    logger.info("🌐 [Main] Starting web server on port %d...", port)
+    run_async(serve(port))
@@ -4,11 +4,17 @@ setup(
     name="telegram-cleanup",
     version="1.2.0",
     packages=["telegram_cleanup"],
+    python_requires=">=3.11",
     include_package_data=True,
     install_requires=[
         "python-dotenv",
         "telethon",
+        "uvloop; sys_platform != 'win32'",
     ],
+    extras_require={
+        # Compiled speedups; everything falls back to pure Python without them
+        "fast": ["orjson", "cryptg"],
+    },
     entry_points={
         "console_scripts": [
             "telegram-cleanup = telegram_cleanup.telegram_cleanup:main_cli",
@@ -1,23 +1,222 @@
 import asyncio
+import collections
 import os
 import re
+import string
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
 from telethon import TelegramClient, events, Button, errors
 from telethon.sessions import StringSession
-from .sdk import TelegramCleaner
-from .config import load_config
+from .sdk import AdaptiveRateLimiter, TelegramCleaner, load_saved_prefs
+from .config import configure_logging, load_config, run_async
 
 # --- Bot State Management ---
-# states: 'IDLE', 'WAITING_PHONE', 'WAITING_CODE', 'WAITING_2FA', 'READY', 'PREVIEWING', 'CLEANING'
-user_states = {}
-user_clients = {} # Store TelegramCleaner instances per user
-user_whitelists = {}
-user_dialogs = {} # Store dialogs for preview
-active_tasks = {}
-last_messages = {} # Track last bot message to keep chat clean
+@dataclass(slots=True)
+class UserSession:
+    """Everything the bot tracks for one user, fetched with a single lookup per update."""
+    # states: 'IDLE', 'WAITING_PHONE', 'WAITING_CODE', 'WAITING_2FA', 'READY', 'PREVIEWING', 'CLEANING'
+    state: str = 'IDLE'
+    cleaner: TelegramCleaner | None = None
+    whitelist: frozenset = frozenset() # Replaced, never mutated, so it can be handed out without copying
+    dialogs: list | None = None # Dialogs kept for preview and export
+    task: asyncio.Task | None = None # Running cleanup
+    last_message: int | None = None # Last bot message, deleted to keep the chat clean
+    last_seen: float = field(default_factory=time.monotonic)
+    authorized: bool = False # Last is_user_authorized() answer, reused for AUTH_CACHE_TTL
+    authorized_at: float = 0.0
+    auth_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    restore_checked: bool = False # Saved login looked up once after a bot restart
+
+sessions = {} # sender ID -> UserSession
+SESSION_TTL = 1800 # Seconds of inactivity before a user's session is dropped
+PRUNE_INTERVAL = 60
+# Login code as users are asked to send it ("code: 1 2 3 4 5"); validates and captures the digits in one pass
+CODE_RE = re.compile(r"(?:code\s*:?\s*)?((?:\d[\s.\-]*){5,7})", re.IGNORECASE)
+# Strips the spaces and punctuation left between the captured digits
+CODE_STRIP_TABLE = str.maketrans("", "", "".join(c for c in string.printable if not c.isdigit()))
+# International phone number once spaces, dashes and brackets are removed
+PHONE_RE = re.compile(r"\+?\d{7,15}")
+PHONE_STRIP_TABLE = str.maketrans("", "", " -()")
+WHITELIST_STRIP_TABLE = str.maketrans("", "", "()")
+BOT_SENDS_PER_SECOND = 25 # Stays under Telegram's ~30 messages/s limit for a bot
+MAX_CONCURRENT_CLEANUPS = 8 # Cleanups running at once across all users; later ones wait their turn
+AUTH_CACHE_TTL = 30 # Seconds a login check is reused while the user clicks through menus
+
+# Fixed keyboards, built once instead of on every render
+# (Buttons are immutable, so the same objects are shared between keyboards)
+WHITELIST_BUTTON = Button.inline("📜 Step 2: Set Whitelist", b"set_whitelist")
+CLEANUP_BUTTON = Button.inline("🚀 Step 3: Start Cleanup", b"run_cleanup")
+LOGOUT_BUTTON = Button.inline("🚪 Logout & Wipe Data", b"logout")
+
+BACK_BUTTONS = [[Button.inline("🔙 Back", b"back_to_start")]]
+MENU_LOGGED_OUT = [
+    [Button.inline("🔑 Step 1: Login", b"login")],
+    [WHITELIST_BUTTON],
+]
+MENU_LOGGED_IN = [
+    [Button.inline("✅ Logged In", b"already_logged_in")],
+    [WHITELIST_BUTTON],
+    [CLEANUP_BUTTON],
+    [LOGOUT_BUTTON],
+]
+LOGGED_IN_BUTTONS = [
+    [CLEANUP_BUTTON],
+    [WHITELIST_BUTTON],
+    [LOGOUT_BUTTON],
+]
+PREVIEW_BUTTONS = [
+    [Button.inline("🚀 Start Cleanup Now", b"confirm_cleanup")],
+    [Button.inline("📦 Export List (JSON)", b"export_cleanup")],
+    [Button.inline("🔙 Back / Change Whitelist", b"back_to_start")],
+]
+BACK_TO_MENU_BUTTONS = [[Button.inline("🔙 Back to Menu", b"back_to_start")]]
+SESSION_EXPIRED_BUTTONS = [Button.inline("🔙 Menu", b"back_to_start")]
+CANCEL_BUTTONS = [[Button.inline("🔙 Cancel", b"back_to_start")]]
+STOP_BUTTONS = [[Button.inline("🔙 Stop / Menu", b"back_to_start")]]
+RETURN_BUTTONS = [[Button.inline("🔙 Return to Menu", b"back_to_start")]]
+START_OVER_BUTTONS = [[Button.inline("🔙 Start Over", b"back_to_start")]]
+
+# Fixed message texts
+WELCOME_TEXT = (
+    "🚀 **Telegram Cleanup Bot — Privacy-First Account Reset**\n"
+    "━━━━━━━━━━━━━━━━━━━━\n"
+    "Reset your Telegram account by removing unwanted chats, leaving inactive groups, and blocking spam bots — safely and efficiently.\n\n"
+    "⚡ **Optimized Processing**\n"
+    "• Intelligent batching system\n"
+    "• Automatic flood-wait handling\n"
+    "• Safe parallel execution\n"
+    "• Designed to handle 1,000+ memberships reliably\n\n"
+    "🔒 **Privacy by Design**\n"
+    "• Uses Telegram’s official MTProto login (no password access)\n"
+    "• Session stored temporarily and encrypted\n"
+    "• One-click “Logout & Wipe” permanently deletes:\n"
+    "  - Session files\n"
+    "  - Cached data\n"
+    "  - Active connections\n"
+    "  - Database records\n"
+    "• Fully open-source & auditable\n\n"
+    "💡 **Flexible Whitelist**\n"
+    "Keep important chats by:\n"
+    "• Username (@Michael)\n"
+    "• Public link (t.me/MyChannel)\n"
+    "• Numeric ID (1685547486)"
+)
+CLEANUP_INIT_TEXT = "⚡ **Step 3: Intelligent Cleanup Initiated!**\n\nPlease watch the dashboard below for live updates."
+DASHBOARD_HEADER = "🛰️ **Cleanup Dashboard**\n━━━━━━━━━━━━━━━━━━━━\n"
+LOGIN_TEXT = (
+    "📱 **Step 1: Secure Login**\n\n"
+    "Please enter your phone number in international format (e.g., `+1234567890`).\n\n"
+    "🛡️ **Trust & Privacy:**\n"
+    "• This creates a temporary session on our server to perform the cleanup.\n"
+    "• You can terminate this session at any time from your Telegram app settings.\n"
+    "• Use 'Logout & Wipe' later to delete all your data here."
+)
+WHITELIST_TEXT_TEMPLATE = (
+    "📝 **Current Whitelist:** `{current}`\n\n"
+    "Send me usernames (@name), links, or IDs to keep.\n"
+    "💡 Items you send will be ADDED to the current list."
+)
+CODE_SENT_TEXT = (
+    "📩 **Login Code Sent!**\n\n"
+    "🔒 **Security Note:** This code is sent directly to Telegram to authorize this session. "
+    "We do not store your credentials. Once you finish, you can 'Logout' to wipe everything.\n\n"
+    "⚠️ **IMPORTANT:** To prevent Telegram from cancelling the code, do NOT send it as a plain number.\n\n"
+    "Please send it in this format: `code: 1 2 3 4 5` (add 'code:' and spaces between digits)."
+)
+LOGGED_IN_TEXT = (
+    "✅ **Successfully logged in!**\n\n"
+    "Your temporary session is now active. You are in full control.\n\n"
+    "⚡ **Ready to Clean?** I will analyze your chats and tell you exactly how "
+    "long it will take before I start.\n\n"
+    "🔒 **Reminder:** You can click 'Logout & Wipe' at any time to purge your "
+    "data from our server."
+)
+LOGOUT_TEXT = (
+    "👋 **Logged out successfully.**\n\n"
+    "🔒 **Privacy Guaranteed:** All your session files, preferences, and progress "
+    "data have been permanently deleted from our server. We no longer have "
+    "access to your account."
+)
+
+def get_session(sender_id):
+    """Returns the user's session, creating an idle one on first contact."""
+    session = sessions.get(sender_id)
+    if session is None:
+        session = sessions[sender_id] = UserSession()
+    session.last_seen = time.monotonic()
+    return session
+
+async def is_authorized(session):
+    """
+    Returns whether the session's client is logged in. Concurrent callers share
+    one in-flight check, and the answer is reused for AUTH_CACHE_TTL seconds.
+    """
+    async with session.auth_lock:
+        if time.monotonic() - session.authorized_at >= AUTH_CACHE_TTL:
+            session.authorized = await session.cleaner.client.is_user_authorized()
+            session.authorized_at = time.monotonic()
+        return session.authorized
+
+def set_authorized(session, authorized):
+    """Records a known login state, e.g. right after sign-in or logout."""
+    session.authorized = authorized
+    session.authorized_at = time.monotonic() if authorized else 0.0
+
+async def stop_task(session):
+    """Cancels the session's cleanup task and waits until it has actually finished."""
+    task, session.task = session.task, None
+    if task and not task.done():
+        task.cancel()
+        # wait() doesn't re-raise the task's CancelledError, but still lets our own cancellation through
+        await asyncio.wait({task})
+
+async def close_session(session):
+    """Stops a session's cleanup task and disconnects its Telegram client."""
+    await stop_task(session)
+    if session.cleaner:
+        with suppress(Exception): await session.cleaner.client.disconnect()
+
+def is_expired(session, cutoff):
+    """Returns True if the session has been idle since before cutoff and has no cleanup running."""
+    return session.last_seen < cutoff and not (session.task and not session.task.done())
+
+async def prune_sessions():
+    """Drops sessions idle for longer than SESSION_TTL so abandoned logins don't hold clients open."""
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        cutoff = time.monotonic() - SESSION_TTL
+        expired = [sender_id for sender_id, session in sessions.items() if is_expired(session, cutoff)]
+        pruned = 0
+        for sender_id in expired:
+            session = sessions.get(sender_id)
+            # The user may have come back while an earlier session was disconnecting
+            if session is None or not is_expired(session, cutoff):
+                continue
+            del sessions[sender_id]
+            await close_session(session)
+            pruned += 1
+        if pruned:
+            print(f"🧹 [Bot] Pruned {pruned} idle user session(s)")
+
+def wipe_user_files(sender_id):
+    """Deletes every file under sessions/ that belongs to the user."""
+    # One directory scan also catches sidecars like SQLite -wal/-shm files and .tmp leftovers
+    session_prefix = f"user_{sender_id}"
+    try:
+        with os.scandir("sessions") as entries:
+            for entry in entries:
+                # Match "user_<id>." / "user_<id>_" so user_12 never wipes user_123's files
+                if entry.name.startswith((f"{session_prefix}.", f"{session_prefix}_")):
+                    try: os.remove(entry.path)
+                    except OSError: pass
+    except FileNotFoundError:
+        pass
 
 def main():
     """Entry point for the bot."""
-    asyncio.run(start_bot())
+    configure_logging()
+    run_async(start_bot())
 
 async def start_bot(on_start=None):
     print("🚀 [Bot] Initialization started.")
@@ -60,7 +259,7 @@ async def start_bot(on_start=None):
         connection_retries=10,
         retry_delay=2,
         auto_reconnect=True,
-        use_ipv6=True
+        use_ipv6=config['use_ipv6']
     )
 
     try:
@@ -90,19 +289,120 @@ async def start_bot(on_start=None):
         print(f"❌ Login error: {e}")
         return
 
-    async def cleanup_old_message(sender_id):
-        """Deletes the last bot message to prevent clutter."""
-        if sender_id in last_messages:
-            try: await bot.delete_messages(sender_id, last_messages[sender_id])
-            except: pass
+    cleanup_slots = asyncio.Semaphore(MAX_CONCURRENT_CLEANUPS)
+    # Shared by every user's cleanup, since the bot's flood limit is global
+    outbound = AdaptiveRateLimiter(base_delay=1.0, max_concurrency=BOT_SENDS_PER_SECOND)
+
+    async def paced(request, *args, **kwargs):
+        """Runs one outbound bot request through the shared limiter, backing off on FloodWait."""
+        await outbound.wait()
+        try:
+            result = await request(*args, **kwargs)
+        except errors.FloodWaitError as e:
+            outbound.backoff(e.seconds)
+            raise
+        outbound.cooldown()
+        return result
+
+    background_tasks = set() # Strong references so fire-and-forget tasks aren't garbage collected
+
+    def spawn(coro):
+        """Runs a coroutine in the background, holding a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    async def delete_message(sender_id, message_id):
+        with suppress(Exception): await bot.delete_messages(sender_id, message_id)
+
+    def cleanup_old_message(sender_id):
+        """Deletes the last bot message to prevent clutter, in the background so the reply isn't held up."""
+        session = sessions.get(sender_id)
+        if session and session.last_message:
+            # The ID is captured now, so a reply recorded right after can't be deleted by mistake
+            spawn(delete_message(sender_id, session.last_message))
+
+    def new_cleaner(sender_id, session_string=None):
+        """Creates a user's cleaner with the bot itself protected from deletion."""
+        session_name = f"user_{sender_id}"
+
+        # Use bot's own API credentials for the user client (config loaded once at startup).
+        # No progress callback here: SDK messages only reach the chat through the cleanup dashboard.
+        cleaner = TelegramCleaner(config, session_name=session_name, session_string=session_string)
+
+        # PROTECT THE BOT ITSELF FROM BEING DELETED
+        if bot_username:
+            cleaner.whitelist_usernames.add(bot_username.lower())
+        if bot_id:
+            cleaner.whitelist_ids.add(bot_id)
+            cleaner.system_whitelist_ids.add(bot_id)
+
+        print(f"🛡️  Added bot protection (ID: {bot_id}) to whitelist for {session_name}")
+        return cleaner
+
+    async def restore_session(sender_id):
+        """
+        Reconnects a user who logged in before the bot restarted, using the session
+        string saved in their prefs, so they don't have to log in again.
+        """
+        session = get_session(sender_id)
+        if session.cleaner or session.restore_checked:
+            return
+        session.restore_checked = True
+
+        prefs = await asyncio.get_running_loop().run_in_executor(None, load_saved_prefs, f"user_{sender_id}")
+        session_string = prefs.get("session_string")
+        if not session_string:
+            return
+
+        cleaner = new_cleaner(sender_id, session_string)
+        try:
+            await cleaner.client.connect()
+            authorized = await cleaner.client.is_user_authorized()
+        except Exception as e:
+            print(f"⚠️ [Bot] Could not restore session for {sender_id}: {e}")
+            authorized = False
+        if not authorized or session.cleaner:
+            with suppress(Exception): await cleaner.client.disconnect()
+            return
+
+        # Adopt the saved prefs so the in-memory copy stays authoritative, as after a fresh login
+        cleaner.prefs.update(prefs)
+        cleaner.prefs["kept_items"] = set(prefs.get("kept_items", ()))
+        session.cleaner = cleaner
+        set_authorized(session, True)
+        session.whitelist = session.whitelist.union(cleaner.prefs["kept_items"])
+        print(f"♻️ [Bot] Restored saved session for {sender_id}")
+
+    async def send_or_edit(event, text, buttons=None):
+        """
+        Edits the clicked message for button presses and sends a fresh one otherwise.
+        Records the result as the user's last message and returns it.
+        """
+        session = get_session(event.sender_id)
+        if isinstance(event, events.CallbackQuery.Event):
+            try:
+                msg = await event.edit(text, buttons=buttons)
+            except errors.MessageNotModifiedError:
+                return None # Same text and buttons already on screen
+            except errors.RPCError as e:
+                # The message may be gone or too old to edit; reply with a fresh one instead
+                print(f"⚠️ Edit failed for {event.sender_id}, sending a new message: {e}")
+                msg = await event.respond(text, buttons=buttons)
+        else:
+            cleanup_old_message(event.sender_id)
+            msg = await event.respond(text, buttons=buttons)
+        session.last_message = msg.id
+        return msg
 
     @bot.on(events.NewMessage(pattern='/start'))
     async def handle_start(event):
         print(f"📥 Received /start from {event.sender_id}")
         sender_id = event.sender_id
-        user_states[sender_id] = 'IDLE'
+        session = get_session(sender_id)
+        session.state = 'IDLE'
         # Run in background to avoid blocking the event loop
-        asyncio.create_task(send_main_menu(event))
+        spawn(send_main_menu(event))
 
     @bot.on(events.NewMessage(pattern='/ping'))
     async def handle_ping(event):
@@ -110,312 +410,228 @@ async def start_bot(on_start=None):
 
     async def send_main_menu(event):
         sender_id = event.sender_id
-        welcome_text = (
-            "🚀 **Telegram Cleanup Bot — Privacy-First Account Reset**\n"
-            "━━━━━━━━━━━━━━━━━━━━\n"
-            "Reset your Telegram account by removing unwanted chats, leaving inactive groups, and blocking spam bots — safely and efficiently.\n\n"
-            "⚡ **Optimized Processing**\n"
-            "• Intelligent batching system\n"
-            "• Automatic flood-wait handling\n"
-            "• Safe parallel execution\n"
-            "• Designed to handle 1,000+ memberships reliably\n\n"
-            "🔒 **Privacy by Design**\n"
-            "• Uses Telegram’s official MTProto login (no password access)\n"
-            "• Session stored temporarily and encrypted\n"
-            "• One-click “Logout & Wipe” permanently deletes:\n"
-            "  - Session files\n"
-            "  - Cached data\n"
-            "  - Active connections\n"
-            "  - Database records\n"
-            "• Fully open-source & auditable\n\n"
-            "💡 **Flexible Whitelist**\n"
-            "Keep important chats by:\n"
-            "• Username (@Michael)\n"
-            "• Public link (t.me/MyChannel)\n"
-            "• Numeric ID (1685547486)"
-        )
-
+        session = get_session(sender_id)
+        await restore_session(sender_id)
         # Fast Login Check: Don't call network if we already know they are active
-        cleaner = user_clients.get(sender_id)
+        cleaner = session.cleaner
         is_logged_in = False
         if cleaner:
             if cleaner.client.is_connected():
                 # If connected, use the faster local check
-                is_logged_in = await cleaner.client.is_user_authorized()
+                is_logged_in = await is_authorized(session)
             else:
                 # If disconnected, it's safer to assume not logged in for the UI
                 is_logged_in = False
 
-        buttons = []
-        if not is_logged_in:
-            buttons.append([Button.inline("🔑 Step 1: Login", b"login")])
-        else:
-            buttons.append([Button.inline("✅ Logged In", b"already_logged_in")])
-
-        buttons.append([Button.inline("📜 Step 2: Set Whitelist", b"set_whitelist")])
-
-        if is_logged_in:
-            buttons.append([Button.inline("🚀 Step 3: Start Cleanup", b"run_cleanup")])
-            buttons.append([Button.inline("🚪 Logout & Wipe Data", b"logout")])
+        buttons = MENU_LOGGED_IN if is_logged_in else MENU_LOGGED_OUT
+        await send_or_edit(event, WELCOME_TEXT, buttons)
 
-        if isinstance(event, events.CallbackQuery.Event):
-            try:
-                msg = await event.edit(welcome_text, buttons=buttons)
-                last_messages[sender_id] = msg.id
-            except:
-                await cleanup_old_message(sender_id)
-                msg = await event.respond(welcome_text, buttons=buttons)
-                last_messages[sender_id] = msg.id
-        else:
-            await cleanup_old_message(sender_id)
-            msg = await event.respond(welcome_text, buttons=buttons)
-            last_messages[sender_id] = msg.id
-
-    @bot.on(events.CallbackQuery(data=b"already_logged_in"))
     async def handle_already_logged_in(event):
-        try: await event.answer("✅ You are already logged in!", alert=True)
-        except: pass
+        with suppress(Exception): await event.answer("✅ You are already logged in!", alert=True)
 
-    @bot.on(events.CallbackQuery(data=b"login"))
     async def handle_login_click(event):
         # Answer instantly
-        try: await event.answer()
-        except: pass
+        with suppress(Exception): await event.answer()
 
         sender_id = event.sender_id
-        user_states[sender_id] = 'WAITING_PHONE'
-        text = (
-            "📱 **Step 1: Secure Login**\n\n"
-            "Please enter your phone number in international format (e.g., `+1234567890`).\n\n"
-            "🛡️ **Trust & Privacy:**\n"
-            "• This creates a temporary session on our server to perform the cleanup.\n"
-            "• You can terminate this session at any time from your Telegram app settings.\n"
-            "• Use 'Logout & Wipe' later to delete all your data here."
-        )
-        buttons = [[Button.inline("🔙 Back", b"back_to_start")]]
-        try:
-            msg = await event.edit(text, buttons=buttons)
-            last_messages[sender_id] = msg.id
-        except:
-            await cleanup_old_message(sender_id)
-            msg = await event.respond(text, buttons=buttons)
-            last_messages[sender_id] = msg.id
+        session = get_session(sender_id)
+        session.state = 'WAITING_PHONE'
+        await send_or_edit(event, LOGIN_TEXT, BACK_BUTTONS)
 
-    @bot.on(events.CallbackQuery(data=b"set_whitelist"))
     async def handle_whitelist_click(event):
         await event.answer()
         sender_id = event.sender_id
+        session = get_session(sender_id)
 
-        if user_states.get(sender_id) == 'CLEANING':
-            await event.respond("⚠️ Cannot update whitelist while cleanup is running!", buttons=[Button.inline("🔙 Back", b"back_to_start")])
+        if session.state == 'CLEANING':
+            await event.respond("⚠️ Cannot update whitelist while cleanup is running!", buttons=BACK_BUTTONS)
             return
+        await restore_session(sender_id)
 
-        # Sync with persistent data
-        cleaner = user_clients.get(sender_id)
+        # Sync with saved items; the cleaner's prefs were loaded at login or restore and are
+        # updated in place since, so there is no need to re-read them (and the progress file) from disk
+        cleaner = session.cleaner
         if cleaner:
-            cleaner._load_data()
-            items = cleaner.prefs.get("kept_items", [])
-            user_whitelists[sender_id] = list(set(user_whitelists.get(sender_id, []) + items))
-
-        current = ", ".join(user_whitelists.get(sender_id, [])) or "None"
-        text = (
-            f"📝 **Current Whitelist:** `{current}`\n\n"
-            "Send me usernames (@name), links, or IDs to keep.\n"
-            "💡 Items you send will be ADDED to the current list."
-        )
-        buttons = [[Button.inline("🔙 Back", b"back_to_start")]]
-        try:
-            msg = await event.edit(text, buttons=buttons)
-            last_messages[sender_id] = msg.id
-        except:
-            await cleanup_old_message(sender_id)
-            msg = await event.respond(text, buttons=buttons)
-            last_messages[sender_id] = msg.id
-        user_states[sender_id] = 'SETTING_WHITELIST'
+            session.whitelist = session.whitelist.union(cleaner.prefs.get("kept_items", ()))
+
+        current = ", ".join(sorted(session.whitelist)) or "None" # Sorted only for display
+        text = WHITELIST_TEXT_TEMPLATE.format(current=current)
+        await send_or_edit(event, text, BACK_BUTTONS)
+        session.state = 'SETTING_WHITELIST'
 
-    @bot.on(events.CallbackQuery(data=b"back_to_start"))
     async def handle_back(event):
         # Answer instantly
-        try: await event.answer()
-        except: pass
+        with suppress(Exception): await event.answer()
 
-        asyncio.create_task(send_main_menu(event))
+        spawn(send_main_menu(event))
 
-    @bot.on(events.NewMessage())
-    async def handle_all_messages(event):
-        # Only handle private messages
-        if not event.is_private: return
+    async def handle_phone_input(event, session, text):
+        """Starts a login for the phone number the user sent."""
         sender_id = event.sender_id
-        state = user_states.get(sender_id, 'IDLE')
-        text = event.text.strip()
-
-        if text.startswith('/'): return # Ignore other commands
-
-        if state == 'WAITING_PHONE':
-            # Clean up old client if exists
-            old_cleaner = user_clients.get(sender_id)
-            if old_cleaner:
-                try: await old_cleaner.client.disconnect()
-                except: pass
-
-            await cleanup_old_message(sender_id)
-            msg = await event.respond("⏳ Sending login code...")
-            last_messages[sender_id] = msg.id
-            session_name = f"user_{sender_id}"
-
-            # Use bot's own API credentials for the user client
-            config = load_config()
+        # Reject malformed numbers before paying for a connection and auth-key exchange
+        phone = text.translate(PHONE_STRIP_TABLE)
+        if not PHONE_RE.fullmatch(phone):
+            cleanup_old_message(sender_id)
+            msg = await event.respond("❌ Invalid phone format. Please send it like `+1234567890`.")
+            session.last_message = msg.id
+            return
 
-            async def progress_report(msg):
-                try:
-                    await bot.send_message(sender_id, msg)
-                except Exception as e:
-                    print(f"Error sending progress: {e}")
+        # Clean up old client if exists
+        old_cleaner = session.cleaner
+        if old_cleaner:
+            with suppress(Exception): await old_cleaner.client.disconnect()
 
-            cleaner = TelegramCleaner(config, session_name=session_name, progress_callback=progress_report)
+        cleanup_old_message(sender_id)
+        msg = await event.respond("⏳ Sending login code...")
+        session.last_message = msg.id
 
-            # PROTECT THE BOT ITSELF FROM BEING DELETED
-            if bot_username:
-                cleaner.whitelist_usernames.add(bot_username.lower())
-            if bot_id:
-                cleaner.whitelist_ids.add(bot_id)
-                cleaner.system_whitelist_ids.add(bot_id)
+        cleaner = new_cleaner(sender_id)
+        session.cleaner = cleaner
+        set_authorized(session, False)
 
-            print(f"🛡️  Added bot protection (ID: {bot_id}) to whitelist for {session_name}")
+        try:
+            await cleaner.client.connect()
+            send_code_result = await cleaner.client.send_code_request(phone)
+            cleaner.phone = phone
+            cleaner.phone_code_hash = send_code_result.phone_code_hash
+            session.state = 'WAITING_CODE'
 
-            user_clients[sender_id] = cleaner
+            await event.respond(CODE_SENT_TEXT, parse_mode='markdown')
+        except Exception as e:
+            await event.respond(f"❌ Error: {str(e)}\nTry /start again.")
+            session.state = 'IDLE'
 
-            try:
-                await cleaner.client.connect()
-                send_code_result = await cleaner.client.send_code_request(text)
-                cleaner.phone = text
-                cleaner.phone_code_hash = send_code_result.phone_code_hash
-                user_states[sender_id] = 'WAITING_CODE'
-
-                msg = (
-                    "📩 **Login Code Sent!**\n\n"
-                    "🔒 **Security Note:** This code is sent directly to Telegram to authorize this session. "
-                    "We do not store your credentials. Once you finish, you can 'Logout' to wipe everything.\n\n"
-                    "⚠️ **IMPORTANT:** To prevent Telegram from cancelling the code, do NOT send it as a plain number.\n\n"
-                    "Please send it in this format: `code: 1 2 3 4 5` (add 'code:' and spaces between digits)."
-                )
-                await event.respond(msg, parse_mode='markdown')
-            except Exception as e:
-                await event.respond(f"❌ Error: {str(e)}\nTry /start again.")
-                user_states[sender_id] = 'IDLE'
-
-        elif state == 'WAITING_CODE':
-            cleaner = user_clients.get(sender_id)
-            try:
-                # Clean the code: remove 'code:', spaces, and other non-digit chars
-                clean_code = re.sub(r'\D', '', text)
-                if not clean_code or len(clean_code) < 5:
-                    await cleanup_old_message(sender_id)
+    async def handle_code_input(event, session, text):
+        """Signs in with the login code the user sent."""
+        sender_id = event.sender_id
+        cleaner = session.cleaner
+        try:
+            if text.isdigit() and 5 <= len(text) <= 7:
+                clean_code = text # Bare digits need no parsing
+            else:
+                match = CODE_RE.fullmatch(text)
+                if not match:
+                    cleanup_old_message(sender_id)
                     msg = await event.respond("❌ Invalid format. Please send like: `code: 1 2 3 4 5`")
-                    last_messages[sender_id] = msg.id
+                    session.last_message = msg.id
                     return
+                clean_code = match.group(1).translate(CODE_STRIP_TABLE)
+
+            await cleaner.client.sign_in(cleaner.phone, clean_code, phone_code_hash=cleaner.phone_code_hash)
+            await finish_login(event, sender_id)
+        except errors.SessionPasswordNeededError:
+            set_authorized(session, False)
+            session.state = 'WAITING_2FA'
+            cleanup_old_message(sender_id)
+            msg = await event.respond("🔑 2FA detected. Please enter your Cloud Password:")
+            session.last_message = msg.id
+        except Exception as e:
+            cleanup_old_message(sender_id)
+            msg = await event.respond(f"❌ Error: {str(e)}")
+            session.last_message = msg.id
 
-                await cleaner.client.sign_in(cleaner.phone, clean_code, phone_code_hash=cleaner.phone_code_hash)
-                await finish_login(event, sender_id)
-            except errors.SessionPasswordNeededError:
-                user_states[sender_id] = 'WAITING_2FA'
-                await cleanup_old_message(sender_id)
-                msg = await event.respond("🔑 2FA detected. Please enter your Cloud Password:")
-                last_messages[sender_id] = msg.id
-            except Exception as e:
-                await cleanup_old_message(sender_id)
-                msg = await event.respond(f"❌ Error: {str(e)}")
-                last_messages[sender_id] = msg.id
-
-        elif state == 'WAITING_2FA':
-            cleaner = user_clients.get(sender_id)
-            try:
-                await cleaner.client.sign_in(password=text)
-                await finish_login(event, sender_id)
-            except Exception as e:
-                await cleanup_old_message(sender_id)
-                msg = await event.respond(f"❌ Incorrect password: {str(e)}")
-                last_messages[sender_id] = msg.id
-
-        elif state == 'SETTING_WHITELIST':
-            # Clean user input: remove parentheses etc
-            raw_items = text.replace('(', '').replace(')', '').split(',')
-            new_items = [i.strip() for i in raw_items if i.strip()]
-
-            existing = user_whitelists.get(sender_id, [])
-            updated = list(set(existing + new_items))
-            user_whitelists[sender_id] = updated
-
-            # Persist if logged in
-            cleaner = user_clients.get(sender_id)
-            if cleaner:
-                cleaner.prefs["kept_items"] = updated
-                cleaner._save_data()
+    async def handle_password_input(event, session, text):
+        """Finishes a 2FA login with the cloud password the user sent."""
+        sender_id = event.sender_id
+        cleaner = session.cleaner
+        try:
+            await cleaner.client.sign_in(password=text)
+            await finish_login(event, sender_id)
+        except Exception as e:
+            cleanup_old_message(sender_id)
+            msg = await event.respond(f"❌ Incorrect password: {str(e)}")
+            session.last_message = msg.id
 
-            user_states[sender_id] = 'IDLE'
-            await cleanup_old_message(sender_id)
-            msg = await event.respond(f"✅ Whitelist updated! Total items: {len(updated)}", buttons=[
-                [Button.inline("🔙 Back to Menu", b"back_to_start")]
-            ])
-            last_messages[sender_id] = msg.id
+    async def handle_whitelist_input(event, session, text):
+        """Adds the items the user sent to their whitelist."""
+        sender_id = event.sender_id
+        # Clean user input: remove parentheses etc
+        raw_items = text.translate(WHITELIST_STRIP_TABLE).split(',')
+        new_items = [i for i in map(str.strip, raw_items) if i]
+
+        session.whitelist = session.whitelist.union(new_items)
+
+        # Persist if logged in, unless the user only re-sent items that are already saved
+        cleaner = session.cleaner
+        if cleaner and session.whitelist != cleaner.prefs.get("kept_items"):
+            cleaner.prefs["kept_items"] = session.whitelist # Never mutated in place, so no copy
+            await cleaner._save_prefs_async()
+
+        session.state = 'IDLE'
+        cleanup_old_message(sender_id)
+        msg = await event.respond(f"✅ Whitelist updated! Total items: {len(session.whitelist)}", buttons=BACK_TO_MENU_BUTTONS)
+        session.last_message = msg.id
+
+    # States in which the next plain message is the user's answer, and who handles it
+    input_handlers = {
+        'WAITING_PHONE': handle_phone_input,
+        'WAITING_CODE': handle_code_input,
+        'WAITING_2FA': handle_password_input,
+        'SETTING_WHITELIST': handle_whitelist_input,
+    }
+
+    # Only private, non-command messages reach the handler; commands have their own
+    @bot.on(events.NewMessage(func=lambda e: e.is_private and not e.raw_text.startswith('/')))
+    async def handle_all_messages(event):
+        session = get_session(event.sender_id)
+        handler = input_handlers.get(session.state)
+        if not handler: return # Nothing is waiting for typed input
+        await handler(event, session, event.raw_text.strip())
 
     async def finish_login(event, sender_id):
-        user_states[sender_id] = 'READY'
-        await cleanup_old_message(sender_id)
-        text = (
-            "✅ **Successfully logged in!**\n\n"
-            "Your temporary session is now active. You are in full control.\n\n"
-            "⚡ **Ready to Clean?** I will analyze your chats and tell you exactly how "
-            "long it will take before I start.\n\n"
-            "🔒 **Reminder:** You can click 'Logout & Wipe' at any time to purge your "
-            "data from our server."
-        )
+        session = get_session(sender_id)
+        set_authorized(session, True)
+        session.state = 'READY'
+
+        # Save the session string so a bot restart doesn't force a new login
+        cleaner = session.cleaner
+        try:
+            await cleaner._load_data_async()
+            await cleaner._save_prefs_async()
+        except Exception as e:
+            print(f"⚠️ [Bot] Could not save session for {sender_id}: {e}")
+        cleanup_old_message(sender_id)
         msg = await bot.send_message(
             sender_id,
-            text,
-            buttons=[
-                [Button.inline("🚀 Step 3: Start Cleanup", b"run_cleanup")],
-                [Button.inline("📜 Step 2: Set Whitelist", b"set_whitelist")],
-                [Button.inline("🚪 Logout & Wipe Data", b"logout")]
-            ]
+            LOGGED_IN_TEXT,
+            buttons=LOGGED_IN_BUTTONS
         )
-        last_messages[sender_id] = msg.id
+        session.last_message = msg.id
 
-    @bot.on(events.CallbackQuery(data=b"run_cleanup"))
     async def handle_run_cleanup(event):
         await event.answer("🔍 Analyzing Account...")
         sender_id = event.sender_id
-        cleaner = user_clients.get(sender_id)
-        if not cleaner or not await cleaner.client.is_user_authorized():
-            await event.respond("⚠️ Session expired. Please login again.", buttons=[Button.inline("🔙 Menu", b"back_to_start")])
+        session = get_session(sender_id)
+        await restore_session(sender_id)
+        cleaner = session.cleaner
+        if not cleaner or not await is_authorized(session):
+            await event.respond("⚠️ Session expired. Please login again.", buttons=SESSION_EXPIRED_BUTTONS)
             return
 
         text = "🔍 **Step 1: Analyzing Account...**\n\nI am scanning your chats, detecting spam, and checking activity levels. This will only take a moment."
-        msg = await event.edit(text, buttons=[[Button.inline("🔙 Cancel", b"back_to_start")]])
-        last_messages[sender_id] = msg.id
+        await send_or_edit(event, text, CANCEL_BUTTONS)
 
         try:
             # Refresh whitelist first
-            whitelist = set(user_whitelists.get(sender_id, []))
-            await cleaner._prepare_whitelist(whitelist)
+            await cleaner._prepare_whitelist(session.whitelist)
 
             # Fetch and Analyze
-            dialogs = await cleaner._safe_iter_dialogs()
-            user_dialogs[sender_id] = dialogs
+            # Keyed by ID so a listing resumed after a FloodWait doesn't count chats twice
+            dialogs = list({d.id: d async for d in cleaner._safe_iter_dialogs()}.values())
+            session.dialogs = dialogs
 
             activity = await cleaner.analyze_activity(dialogs)
 
-            # Count to-be-deleted items
-            to_remove = []
+            # Count to-be-deleted items; only the counts are shown, so no list is built
+            to_remove = 0
             spam_bots = 0
             for d in dialogs:
                 if not cleaner._is_whitelisted(d.entity):
-                    to_remove.append(d)
-                    if getattr(d.entity, 'bot', False):
-                        if cleaner.calculate_spam_score(d.entity) > 50:
-                            spam_bots += 1
+                    to_remove += 1
+                    if getattr(d.entity, 'bot', False) and cleaner.calculate_spam_score(d.entity) > 50:
+                        spam_bots += 1
 
-            total_whitelisted = len(dialogs) - len(to_remove)
+            total_whitelisted = len(dialogs) - to_remove
             est_time = cleaner.estimate_duration(len(dialogs), total_whitelisted)
 
             preview_text = (
@@ -423,7 +639,7 @@ async def start_bot(on_start=None):
                 "━━━━━━━━━━━━━━━━━━━━\n"
                 f"📂 **Total Chats:** {len(dialogs)}\n"
                 f"💎 **Whitelisted:** {total_whitelisted}\n"
-                f"🗑️  **Items to Remove:** {len(to_remove)}\n\n"
+                f"🗑️  **Items to Remove:** {to_remove}\n\n"
                 "⚡ **Advanced Intelligence:**\n"
                 f"• 🧟 **Inactive (30d+):** {activity['inactive_30d'] + activity['inactive_90d']}\n"
                 f"• 🤖 **Suspected Spam Bots:** {spam_bots}\n"
@@ -432,24 +648,17 @@ async def start_bot(on_start=None):
                 "What would you like to do next?"
             )
 
-            buttons = [
-                [Button.inline("🚀 Start Cleanup Now", b"confirm_cleanup")],
-                [Button.inline("📦 Export List (JSON)", b"export_cleanup")],
-                [Button.inline("🔙 Back / Change Whitelist", b"back_to_start")]
-            ]
-
-            user_states[sender_id] = 'PREVIEWING'
-            msg = await event.edit(preview_text, buttons=buttons)
-            last_messages[sender_id] = msg.id
+            session.state = 'PREVIEWING'
+            await send_or_edit(event, preview_text, PREVIEW_BUTTONS)
 
         except Exception as e:
-            await event.respond(f"❌ Analysis failed: {str(e)}", buttons=[[Button.inline("🔙 Back", b"back_to_start")]])
+            await event.respond(f"❌ Analysis failed: {str(e)}", buttons=BACK_BUTTONS)
 
-    @bot.on(events.CallbackQuery(data=b"export_cleanup"))
     async def handle_export(event):
         sender_id = event.sender_id
-        cleaner = user_clients.get(sender_id)
-        dialogs = user_dialogs.get(sender_id)
+        session = get_session(sender_id)
+        cleaner = session.cleaner
+        dialogs = session.dialogs
 
         if not cleaner or not dialogs:
             await event.answer("⚠️ Data missing, please restart analysis.")
@@ -465,118 +674,125 @@ async def start_bot(on_start=None):
         except Exception as e:
             await event.respond(f"❌ Export failed: {str(e)}")
 
-    @bot.on(events.CallbackQuery(data=b"confirm_cleanup"))
     async def handle_confirm_cleanup(event):
         sender_id = event.sender_id
-        cleaner = user_clients.get(sender_id)
+        session = get_session(sender_id)
+        cleaner = session.cleaner
         if not cleaner: return
 
-        user_states[sender_id] = 'CLEANING'
-        text = "⚡ **Step 3: Intelligent Cleanup Initiated!**\n\nPlease watch the dashboard below for live updates."
-        buttons = [[Button.inline("🔙 Stop / Menu", b"back_to_start")]]
-        await event.edit(text, buttons=buttons)
-
-        whitelist = set(user_whitelists.get(sender_id, []))
+        # Let a previous run finish unwinding first, or its finally would reset the state below
+        await stop_task(session)
+        session.state = 'CLEANING'
+        await event.edit(CLEANUP_INIT_TEXT, buttons=STOP_BUTTONS)
 
-        if sender_id in active_tasks:
-            active_tasks[sender_id].cancel()
-
-        task = asyncio.create_task(run_cleanup_task(sender_id, cleaner, whitelist))
-        active_tasks[sender_id] = task
+        whitelist = session.whitelist
+        session.task = asyncio.create_task(run_cleanup_task(sender_id, cleaner, whitelist))
 
     async def run_cleanup_task(sender_id, cleaner, whitelist):
+        session = get_session(sender_id)
         try:
             # Dashboard message
             try:
-                dashboard = await bot.send_message(sender_id, "⚙️ **Preparing Intelligent Cleanup...**")
-            except:
+                dashboard = await paced(bot.send_message, sender_id, "⚙️ **Preparing Intelligent Cleanup...**")
+            except Exception:
                 return # User blocked the bot
 
-            log_buffer = []
-            last_update = 0
-            lock = asyncio.Lock()
+            log_buffer = collections.deque(maxlen=10) # Oldest lines fall off as new ones arrive
+            changed = asyncio.Event()
 
             async def bot_progress_callback(msg):
-                nonlocal last_update
-                async with lock:
-                    log_buffer.append(msg)
-                    if len(log_buffer) > 10:
-                        log_buffer.pop(0)
-
-                now = asyncio.get_event_loop().time()
-                if now - last_update > 1.5: # Respect Telegram edit limits (1.5s to be safe)
-                    last_update = now
-                    try:
-                        logs = "\n".join(log_buffer)
-                        await dashboard.edit(f"🛰️ **Cleanup Dashboard**\n━━━━━━━━━━━━━━━━━━━━\n{logs}")
-                    except Exception:
-                        pass
-
-            cleaner.progress_callback = bot_progress_callback
-            await cleaner.run_cleanup(whitelist)
-
-            try:
-                await bot.send_message(sender_id, "🏁 **Cleanup Mission Complete!**\n\nYour account is now clean.", buttons=[
-                    [Button.inline("🔙 Return to Menu", b"back_to_start")]
-                ])
-            except: pass
+                # Only record the line; flush_dashboard does the editing
+                log_buffer.append(msg)
+                changed.set()
+
+            async def edit_dashboard():
+                with suppress(Exception):
+                    await paced(dashboard.edit, DASHBOARD_HEADER + "\n".join(log_buffer))
+
+            async def flush_dashboard():
+                """Applies buffered lines with at most one edit per 1.5s (Telegram edit limits)."""
+                while True:
+                    await changed.wait()
+                    changed.clear()
+                    await edit_dashboard()
+                    await asyncio.sleep(1.5)
+
+            if cleanup_slots.locked():
+                with suppress(Exception): await paced(dashboard.edit, "⏳ **Queued:** other cleanups are running. Yours starts as soon as a slot frees up.")
+
+            async with cleanup_slots:
+                cleaner.progress_callback = bot_progress_callback
+                flusher = asyncio.create_task(flush_dashboard())
+                try:
+                    await cleaner.run_cleanup(whitelist)
+                finally:
+                    flusher.cancel()
+                    cleaner.progress_callback = None
+                    # Join the flusher so its in-flight edit can't land after the final one
+                    await asyncio.wait({flusher})
+                    if changed.is_set():
+                        await edit_dashboard() # Show the final lines too
+
+            with suppress(Exception):
+                await paced(bot.send_message, sender_id, "🏁 **Cleanup Mission Complete!**\n\nYour account is now clean.", buttons=RETURN_BUTTONS)
         except Exception as e:
-            try:
-                await bot.send_message(sender_id, f"⚠️ **Cleanup Interrupted:**\n`{str(e)}`", buttons=[
-                    [Button.inline("🔙 Back", b"back_to_start")]
-                ])
-            except: pass
+            with suppress(Exception):
+                await paced(bot.send_message, sender_id, f"⚠️ **Cleanup Interrupted:**\n`{str(e)}`", buttons=BACK_BUTTONS)
         finally:
-            user_states[sender_id] = 'READY'
+            session.state = 'READY'
 
-    @bot.on(events.CallbackQuery(data=b"logout"))
     async def handle_logout(event):
         await event.answer("👋 Wiping session data...")
         sender_id = event.sender_id
+        session = get_session(sender_id)
 
-        if sender_id in active_tasks:
-            active_tasks[sender_id].cancel()
-            try: del active_tasks[sender_id]
-            except: pass
+        # The task must be gone before its client is logged out and its files are wiped
+        await stop_task(session)
 
-        cleaner = user_clients.pop(sender_id, None)
-        if cleaner:
+        cleaner, session.cleaner = session.cleaner, None
+        set_authorized(session, False)
+
+        async def sign_out():
             try:
                 # Disconnect instead of log_out to keep the session file if they want to re-login,
                 # BUT the user said "Wipe Data", so we log_out.
                 await cleaner.client.log_out()
                 await cleaner.client.disconnect()
             except Exception:
-                try: await cleaner.client.disconnect()
-                except: pass
-
-        # Thoroughly clean up all user-related files
-        session_prefix = f"user_{sender_id}"
-        files_to_remove = [
-            f"sessions/{session_prefix}.session",
-            f"sessions/{session_prefix}.session-journal",
-            f"sessions/{session_prefix}_prefs.json",
-            f"sessions/{session_prefix}_progress.json"
-        ]
-        for f in files_to_remove:
-            if os.path.exists(f):
-                try: os.remove(f)
-                except: pass
-
-        user_states[sender_id] = 'IDLE'
-        text = (
-            "👋 **Logged out successfully.**\n\n"
-            "🔒 **Privacy Guaranteed:** All your session files, preferences, and progress "
-            "data have been permanently deleted from our server. We no longer have "
-            "access to your account."
-        )
-        buttons = [[Button.inline("🔙 Start Over", b"back_to_start")]]
-        try:
-            await event.edit(text, buttons=buttons)
-        except Exception:
-            await event.respond(text, buttons=buttons)
+                with suppress(Exception): await cleaner.client.disconnect()
 
-    await bot.run_until_disconnected()
+        # The Telegram round trips and the local file wipe don't depend on each other
+        async with asyncio.TaskGroup() as tg:
+            if cleaner:
+                tg.create_task(sign_out())
+            tg.create_task(asyncio.to_thread(wipe_user_files, sender_id))
+
+        session.state = 'IDLE'
+        await send_or_edit(event, LOGOUT_TEXT, START_OVER_BUTTONS)
+
+    # One handler routes every button press with a dict lookup instead of a filter per button
+    callbacks = {
+        b"already_logged_in": handle_already_logged_in,
+        b"login": handle_login_click,
+        b"set_whitelist": handle_whitelist_click,
+        b"back_to_start": handle_back,
+        b"run_cleanup": handle_run_cleanup,
+        b"export_cleanup": handle_export,
+        b"confirm_cleanup": handle_confirm_cleanup,
+        b"logout": handle_logout,
+    }
+
+    @bot.on(events.CallbackQuery())
+    async def dispatch_callback(event):
+        handler = callbacks.get(event.data)
+        if handler:
+            await handler(event)
+
+    pruner = asyncio.create_task(prune_sessions())
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        pruner.cancel()
 
 if __name__ == "__main__":
     main()
@@ -1,14 +1,30 @@
+import asyncio
+import logging
 import os
 import sys
 from dotenv import load_dotenv
 
+try:
+    import uvloop # Optional: faster event loop on Linux/macOS
+except ImportError:
+    uvloop = None
+
+def configure_logging():
+    """Configure plain console logging; the level comes from LOG_LEVEL (default INFO)."""
+    logging.basicConfig(
+        level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+        format="%(message)s",
+    )
+
+def run_async(main):
+    """Runs a coroutine to completion on uvloop when it is installed, else the stock loop."""
+    with asyncio.Runner(loop_factory=uvloop.new_event_loop if uvloop else None) as runner:
+        return runner.run(main)
+
 def load_config():
     """Load and validate environment variables."""
-    # Try to load .env from the current working directory
-    env_path = os.path.join(os.getcwd(), '.env')
-    if os.path.exists(env_path):
-        load_dotenv(env_path)
-    else:
+    # Try to load .env from the current working directory; load_dotenv returns False if it is missing
+    if not load_dotenv(os.path.join(os.getcwd(), '.env')):
         load_dotenv() # Fallback to default search
 
     api_id = os.getenv("API_ID")
@@ -16,6 +32,8 @@ def load_config():
     phone = os.getenv("PHONE")
     bot_token = os.getenv("BOT_TOKEN")
     whitelist_env = os.getenv("WHITELIST", "")
+    # IPv6 is opt-in: on hosts where it is advertised but badly routed, every (re)connect stalls on it first
+    use_ipv6 = os.getenv("USE_IPV6", "").strip().lower() in ("1", "true", "yes")
 
     # Check for missing variables first
     missing = []
@@ -47,5 +65,6 @@ def load_config():
         "api_hash": api_hash.strip() if api_hash else None,
         "phone": phone.strip() if phone else None,
         "bot_token": bot_token,
-        "whitelist": [item.strip() for item in whitelist_env.split(",") if item.strip()]
+        "whitelist": [item for item in map(str.strip, whitelist_env.split(",")) if item],
+        "use_ipv6": use_ipv6
     }
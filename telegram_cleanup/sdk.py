@@ -1,61 +1,265 @@
 import asyncio
+import functools
+import hashlib
 import json
 import os
 import random
+import re
 import sys
-import tempfile
-from datetime import datetime
+import threading
+import time
+import weakref
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
 import getpass
+import logging
 
 from telethon import TelegramClient, errors
 from telethon.sessions import StringSession
-from telethon.tl.types import Channel, User, MessageService
+from telethon.tl.types import Channel, Chat, User, MessageService
 from telethon.tl.functions.channels import LeaveChannelRequest
 from telethon.tl.functions.contacts import BlockRequest
 
+try:
+    import orjson # Optional: much faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
 # --- Constants ---
 DEFAULT_SESSION = "telegram_cleanup"
-CONCURRENCY_LIMIT = 2
+PROGRESS_FLUSH_INTERVAL = 5 # Seconds to coalesce progress updates before writing
+FILE_TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+ERROR_PROCESSING = "Error processing %s: %s"
+# Whitelist entry shapes: numeric IDs, and @usernames or t.me links (captures the username)
+WHITELIST_ID_RE = re.compile(r"-?\d+")
+WHITELIST_USERNAME_RE = re.compile(r"^@(\S+)|t\.me/([^/?\s]+)")
+# Skipped names that belong to system protection (Saved Messages, service notifications), not the user's whitelist
+SYSTEM_NAME_RE = re.compile(r"Saved Messages|Telegram|ID: 777000")
+WHITELIST_RESOLVE_CONCURRENCY = 5 # Username lookups in flight at once
+# Name matched against whitelisted titles, picked by entity type instead of attribute probing
+WHITELIST_NAME_GETTERS = {
+    Channel: lambda e: e.title,
+    Chat: lambda e: e.title,
+    User: lambda e: " ".join(filter(None, (e.first_name, e.last_name))),
+}
+# Name/username fragments common in spam bots, each worth 30 points of spam score
+SPAM_PATTERNS = ('crypto', 'invest', 'trading', 'profit', 'casino', 'bet', 'porn', 'sex', 'hot', 'free', 'money')
+MAX_FLOOD_RETRIES = 7 # FloodWait retries per action before giving up
+# Worker ceiling per cleanup action; blocks and deletes are rate-limited harder than leaves
+ACTION_CONCURRENCY = {"_leave_channel": 5, "_block_bot": 3, "_delete_private_chat": 3}
+ACTION_LABELS = {"_leave_channel": "Leave", "_block_bot": "Bots", "_delete_private_chat": "Chats"}
 
 # --- Utility: Atomic File Writing ---
-def _atomic_write(filename, data):
-    """Safely write JSON data to a file atomically."""
+# Writes may come from worker threads (asyncio.to_thread), so they share one temp path per file.
+# Each file has its own lock, so one user's fsync never holds up another user's saves.
+_path_locks = weakref.WeakValueDictionary() # filename -> lock, dropped once no writer holds it
+_path_locks_guard = threading.Lock()
+_written_digests = {} # filename -> SHA-256 of the last payload written to it
+
+def _path_lock(filename):
+    """Returns the lock serializing writes to filename."""
+    with _path_locks_guard:
+        lock = _path_locks.get(filename)
+        if lock is None:
+            lock = _path_locks[filename] = threading.Lock()
+        return lock
+
+def _dump_json(data, indent=4):
+    """Serializes data to JSON bytes, using orjson when it is installed."""
+    if orjson:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    # Machine-read files skip indentation for faster, smaller dumps
+    separators = None if indent else (',', ':')
+    return json.dumps(data, indent=indent, separators=separators).encode()
+
+def _load_json(filename):
+    """Reads a JSON file, using orjson when it is installed."""
+    with open(filename, "rb") as f:
+        raw = f.read()
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _atomic_write(filename, data, indent=4, dedupe=True):
+    """
+    Safely write JSON data to a file atomically. Returns True once the file holds the data on disk.
+    dedupe skips rewriting an unchanged payload; one-off files pass False so no digest is kept for them.
+    """
+    # A stable sibling path avoids creating a new randomly named file on every save
+    tempname = f"{filename}.tmp"
+    try:
+        payload = _dump_json(data, indent)
+        digest = hashlib.sha256(payload).digest() if dedupe else None
+        with _path_lock(filename):
+            # Saves often repeat unchanged prefs and logs; skip the disk round-trip for those
+            if dedupe and _written_digests.get(filename) == digest and os.path.exists(filename):
+                return True
+            with open(tempname, 'wb') as tf:
+                tf.write(payload)
+                tf.flush()
+                # Make sure the data is on disk before the rename makes it visible
+                os.fsync(tf.fileno())
+            os.replace(tempname, filename)
+            if dedupe:
+                _written_digests[filename] = digest
+        return True
+    except Exception as e:
+        logger.warning("⚠️ Atomic write failed for %s: %s", filename, e)
+        return False
+
+@functools.cache
+def _ensure_sessions_dir():
+    """Creates the sessions/ directory once per process; the bot builds a cleaner per login."""
+    os.makedirs("sessions", exist_ok=True)
+
+def load_saved_prefs(session_name):
+    """Returns the preferences saved for a session, or an empty dict if there are none."""
+    try:
+        return _load_json(os.path.join("sessions", f"{session_name}_prefs.json"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _write_all(writes):
+    """Atomically writes each (filename, data, indent) entry. Returns the filenames that could not be written."""
+    return {filename for filename, data, indent in writes if not _atomic_write(filename, data, indent)}
+
+def _append_lines(filename, values):
+    """Appends one JSON value per line to a journal file."""
+    payload = b"".join(_dump_json(value, None) + b"\n" for value in values)
     try:
-        with tempfile.NamedTemporaryFile('w', delete=False, dir='.') as tf:
-            json.dump(data, tf, indent=4)
-            tempname = tf.name
-        os.replace(tempname, filename)
+        with _path_lock(filename):
+            with open(filename, 'ab') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
     except Exception as e:
-        print(f"⚠️ Atomic write failed for {filename}: {str(e)}")
+        logger.warning("⚠️ Journal append failed for %s: %s", filename, e)
+
+def _read_lines(filename):
+    """Reads a journal written by _append_lines, skipping a torn last line."""
+    values = []
+    try:
+        with open(filename, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # Unterminated line from an interrupted append
+                try:
+                    values.append(orjson.loads(line) if orjson else json.loads(line))
+                except ValueError:
+                    break
+    except FileNotFoundError:
+        pass
+    return values
+
+@dataclass(slots=True)
+class CleanupLogs:
+    """Counters and records for a single cleanup run."""
+    channels_left: int = 0
+    groups_left: int = 0
+    bots_blocked_deleted: int = 0
+    private_chats_blocked_deleted: int = 0
+    errors: list = field(default_factory=list)
+    skipped_items: set = field(default_factory=set)
+    timestamp: str = field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    remaining_chats: int = 0
+
+def _first_exception(group):
+    """Returns the first leaf exception of a (possibly nested) exception group."""
+    while isinstance(group, BaseExceptionGroup):
+        group = group.exceptions[0]
+    return group
+
+async def _as_async_iter(items):
+    """Adapts a plain iterable to an async iterator; async iterators pass through."""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
 
 class AdaptiveRateLimiter:
     """Intelligently manages delays and concurrency to avoid FloodWaitErrors."""
-    def __init__(self, base_delay=0.6):
+    def __init__(self, base_delay=0.6, max_concurrency=5, parent=None):
         self.base_delay = base_delay
+        self.parent = parent # Account-wide limiter shared with sibling limiters
         self.current_delay = base_delay
         self.multiplier = 1.0
-        self.max_concurrency = 5
-        self.concurrency = 2 # Start with a safe concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = min(2, max_concurrency) # Start with a safe concurrency
+        self.last_flood = 0.0
+        self.pass_delay = 0.0
+        self.successes = 0 # Consecutive successes since the last FloodWait
+        self.resume_at = 0.0 # Shared pause for all workers after a long FloodWait
+        self._grown = asyncio.Event() # Set whenever concurrency is raised
+        self.next_slot = 0.0 # Token bucket: earliest time the next action may start
 
     async def wait(self):
-        # Destructive actions need a gap
-        delay = (self.current_delay * self.multiplier) + (random.random() * 0.2)
-        await asyncio.sleep(delay)
+        """Paces actions through a shared token bucket instead of a fixed sleep per action."""
+        now = time.monotonic()
+        # Honor a pool-wide pause before pacing this action
+        start = max(now, self.resume_at)
+        # One token per interval across all workers; a burst of up to `concurrency` goes out at once
+        interval = self.current_delay * self.multiplier / self.concurrency
+        slot = max(self.next_slot, start)
+        self.next_slot = slot + interval
+        delay = max(slot - interval * (self.concurrency - 1), start) - now
+        if delay > 0:
+            # Destructive actions need a gap; jitter keeps workers from firing in lockstep
+            await asyncio.sleep(delay + random.random() * 0.2)
+        if self.parent:
+            # The parent's bucket caps the combined rate of every limiter sharing it
+            await self.parent.wait()
 
     def backoff(self, seconds):
         """Increases the delay significantly and drops concurrency after a FloodWait."""
         self.multiplier = min(self.multiplier * 2.2, 10.0)
         self.current_delay = max(self.current_delay, seconds / 10.0)
         self.concurrency = 1 # Drop to safety
-        print(f"⚠️  Limiter: Backing off. Concurrency set to 1. Base delay: {self.current_delay:.1f}s")
+        self.last_flood = time.monotonic()
+        self.pass_delay = min(max(self.pass_delay * 2, 1.0), 60.0)
+        self.successes = 0
+        if seconds > 60:
+            # Long waits apply account-wide, so pause every worker instead of letting each one find out
+            self.resume_at = max(self.resume_at, self.last_flood + seconds)
+        logger.warning("⚠️  Limiter: Backing off. Concurrency set to 1. Base delay: %.1fs", self.current_delay)
+        if self.parent:
+            # FloodWaits are account-wide: slow the shared pace, pause siblings, and widen the pass gap
+            self.parent.backoff(seconds)
+
+    def retry_delay(self, seconds, retry_count):
+        """Returns the wait for a FloodWait retry: the server hint, grown gently, plus jitter."""
+        wait = min(seconds * (1.5 ** retry_count), 300)
+        # Jitter keeps workers that hit the same limit from waking at the same instant
+        return wait + random.uniform(0, min(5, wait * 0.1))
+
+    def pass_gap(self):
+        """Returns the pause between passes; zero once no FloodWait has been seen for a minute."""
+        if time.monotonic() - self.last_flood > 60:
+            self.pass_delay = 0.0
+        if not self.pass_delay:
+            return 0.0
+        return self.pass_delay + random.uniform(0, 1)
 
     def cooldown(self):
         """Slowly reduces the multiplier and increases concurrency when things are working well."""
         self.multiplier = max(1.0, self.multiplier * 0.85)
+        self.successes += 1
+        if self.successes % 10 == 0:
+            self.pass_delay *= 0.5
         if self.multiplier < 1.5 and self.concurrency < self.max_concurrency:
             if random.random() < 0.25: # Faster ramp up
                 self.concurrency += 1
-                print(f"📈 Limiter: Increasing concurrency to {self.concurrency}")
+                self._grown.set()
+                logger.info("📈 Limiter: Increasing concurrency to %d", self.concurrency)
+        if self.parent:
+            self.parent.cooldown()
+
+    async def acquire_slot(self, index):
+        """Parks worker `index` until it fits within the current concurrency."""
+        while index >= self.concurrency:
+            self._grown.clear()
+            await self._grown.wait()
 
 class TelegramCleaner:
     """A class to encapsulate the logic for cleaning a Telegram account."""
@@ -70,7 +274,7 @@ class TelegramCleaner:
             session_string (str): Optional Telethon StringSession string.
         """
         # Use a sessions/ directory for better security and organization
-        os.makedirs("sessions", exist_ok=True)
+        _ensure_sessions_dir()
 
         # Use StringSession to avoid SQLite "database is locked" errors and disk I/O lag
         session = StringSession(session_string) if session_string else StringSession()
@@ -79,62 +283,64 @@ class TelegramCleaner:
             session,
             config["api_id"],
             config["api_hash"],
-            use_ipv6=True, # Often faster if available
+            use_ipv6=config.get("use_ipv6", False),
             flood_sleep_threshold=10 # Let the AdaptiveRateLimiter handle long waits
         )
         self.phone = config.get("phone")
         self.session_name = session_name
         self.pref_file = os.path.join("sessions", f"{session_name}_prefs.json")
         self.progress_file = os.path.join("sessions", f"{session_name}_progress.json")
+        # Append-only journal of processed IDs, folded into progress_file on save
+        self.progress_journal = os.path.join("sessions", f"{session_name}_progress.jsonl")
 
         self.progress_callback = progress_callback
-        self.logs = self._init_logs()
-        self.prefs = {"kept_items": [], "session_string": session_string}
-        self.progress = {"processed_ids": []}
+        self._start_run_log()
+        self.prefs = {"kept_items": set(), "session_string": session_string}
+        self.progress = {"processed_ids": set()}
+        self._progress_dirty = asyncio.Event()
+        self._pending_ids = [] # Processed IDs not yet appended to the journal
         self.whitelist_ids = set()
         self.system_whitelist_ids = set()
         self.whitelist_usernames = set()
         self.whitelist_titles = set()
         self.whitelist_counts = {"channels": 0, "groups": 0, "bots": 0, "users": 0}
-        self.semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
+        self._classified = {} # entity ID -> (name, action), reused across verification passes
+        self._whitelisted = {} # entity ID -> whitelist verdict, reset when the whitelist is rebuilt
         self.limiter = AdaptiveRateLimiter()
 
     async def log_and_report(self, message):
         """Prints a message and optionally reports it via the callback."""
-        print(message)
+        logger.info("%s", message)
         if self.progress_callback:
             await self.progress_callback(message)
 
     def _init_logs(self):
-        """Initializes the log dictionary."""
-        return {
-            "channels_left": 0,
-            "groups_left": 0,
-            "bots_blocked_deleted": 0,
-            "private_chats_blocked_deleted": 0,
-            "errors": [],
-            "skipped_items": [],
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "remaining_chats": 0
-        }
+        """Initializes the run logs."""
+        return CleanupLogs()
+
+    def _start_run_log(self):
+        """Starts fresh logs and a new log file name for a run."""
+        self.logs = self._init_logs()
+        # One log file per run; repeated saves overwrite it instead of spawning new files
+        self.log_file = f"cleanup_{self.session_name}_{datetime.now().strftime(FILE_TIMESTAMP_FORMAT)}.json"
 
     async def connect(self):
         """Connects to the Telegram client."""
         try:
             await self.client.start(phone=self.phone)
-            print("✅ Logged in successfully")
+            logger.info("✅ Logged in successfully")
         except errors.PhoneNumberInvalidError:
-            print("❌ Error: Invalid phone number format")
+            logger.error("❌ Error: Invalid phone number format")
             sys.exit(1)
         except errors.SessionPasswordNeededError:
             password = getpass.getpass("🔑 Enter 2FA password: ")
             try:
                 await self.client.sign_in(password=password)
             except Exception as e:
-                print(f"❌ 2FA error: {str(e)}")
+                logger.error("❌ 2FA error: %s", e)
                 sys.exit(1)
         except Exception as e:
-            print(f"❌ Login error: {str(e)}")
+            logger.error("❌ Login error: %s", e)
             sys.exit(1)
 
     async def disconnect(self):
@@ -144,62 +350,131 @@ class TelegramCleaner:
     def _load_data(self):
         """Loads preferences and progress from files."""
         try:
-            with open(self.pref_file, "r") as f:
-                self.prefs = json.load(f)
-                # Migration: if old kept_bots exists, move to kept_items
-                if "kept_bots" in self.prefs:
-                    if "kept_items" not in self.prefs:
-                        self.prefs["kept_items"] = self.prefs["kept_bots"]
-                    del self.prefs["kept_bots"]
+            self.prefs = _load_json(self.pref_file)
+            # Migration: if old kept_bots exists, move to kept_items
+            if "kept_bots" in self.prefs:
+                if "kept_items" not in self.prefs:
+                    self.prefs["kept_items"] = self.prefs["kept_bots"]
+                del self.prefs["kept_bots"]
         except FileNotFoundError:
-            self.prefs = {"kept_items": []}
+            self.prefs = {}
+        # Kept in memory as a set; sorted only when written back
+        self.prefs["kept_items"] = set(self.prefs.get("kept_items", ()))
 
         try:
-            with open(self.progress_file, "r") as f:
-                self.progress = json.load(f)
+            data = _load_json(self.progress_file)
+            self.progress = {"processed_ids": set(data.get("processed_ids", []))}
         except FileNotFoundError:
-            self.progress = {"processed_ids": []}
+            self.progress = {"processed_ids": set()}
+        # IDs journaled after the last consolidated save
+        self.progress["processed_ids"].update(_read_lines(self.progress_journal))
 
-        print(f"📋 Loaded preferences and progress for {self.session_name}")
+        logger.info("📋 Loaded preferences and progress for %s", self.session_name)
 
-    def _save_data(self):
-        """Saves preferences, progress, and logs to files."""
+    async def _load_data_async(self):
+        """Like _load_data, but reads the files in the default executor."""
+        await asyncio.get_running_loop().run_in_executor(None, self._load_data)
+
+    def _prefs_write(self):
+        """Snapshots preferences as a (filename, data, indent) write."""
         # Update session string if available
         if self.client.is_connected():
             self.prefs["session_string"] = self.client.session.save()
 
-        _atomic_write(self.pref_file, self.prefs)
+        prefs = dict(self.prefs)
+        prefs["kept_items"] = sorted(prefs.get("kept_items", ()))
+        return (self.pref_file, prefs, 4)
 
-        _atomic_write(self.progress_file, self.progress)
+    def _state_writes(self):
+        """Snapshots preferences, progress, and logs as (filename, data, indent) writes."""
+        return (
+            self._prefs_write(),
+            (self.progress_file, self._progress_snapshot(), None),
+            (self.log_file, self._logs_snapshot(), 4),
+        )
 
-        log_file = f"cleanup_{self.session_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        _atomic_write(log_file, self.logs)
-        print(f"📝 State saved for {self.session_name}")
+    def _write_state(self, writes):
+        """Writes the snapshot; the consolidated progress file makes the journal redundant."""
+        if self.progress_file in _write_all(writes):
+            # The journal is the only record of this run's progress until the snapshot lands
+            logger.warning("⚠️ Keeping the progress journal for %s; the snapshot was not saved", self.session_name)
+            return
+        try:
+            os.remove(self.progress_journal)
+        except FileNotFoundError:
+            pass
+
+    def _logs_snapshot(self):
+        """Returns the run logs in a JSON-serializable form."""
+        logs = asdict(self.logs)
+        logs["skipped_items"] = sorted(logs["skipped_items"])
+        return logs
+
+    def _save_data(self):
+        """Saves preferences, progress, and logs to files."""
+        self._write_state(self._state_writes())
+        logger.info("📝 State saved for %s", self.session_name)
+
+    async def _save_data_async(self):
+        """Like _save_data, but writes the files in the default executor."""
+        # Snapshot on the event loop so the session and logs are read consistently
+        writes = self._state_writes()
+        await asyncio.get_running_loop().run_in_executor(None, self._write_state, writes)
+        logger.info("📝 State saved for %s", self.session_name)
+
+    async def _save_prefs_async(self):
+        """Writes only the preferences (and so the session string) in the default executor."""
+        writes = (self._prefs_write(),)
+        await asyncio.get_running_loop().run_in_executor(None, _write_all, writes)
+
+    def _mark_processed(self, entity_id):
+        """Records a processed entity and schedules a debounced progress flush."""
+        self.progress["processed_ids"].add(entity_id)
+        self._pending_ids.append(entity_id)
+        self._progress_dirty.set()
+
+    def _take_pending_ids(self):
+        """Returns the IDs waiting to be journaled and starts a new batch."""
+        self._progress_dirty.clear()
+        pending, self._pending_ids = self._pending_ids, []
+        return pending
+
+    async def _progress_flusher(self):
+        """Journals new progress at most once per flush interval while updates keep arriving."""
+        while True:
+            await self._progress_dirty.wait()
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            # Only the new IDs are appended, so each flush costs O(batch), not O(total)
+            await asyncio.to_thread(_append_lines, self.progress_journal, self._take_pending_ids())
+
+    def _flush_progress(self):
+        """Journals pending progress, if any."""
+        if self._progress_dirty.is_set():
+            _append_lines(self.progress_journal, self._take_pending_ids())
+
+    def _progress_snapshot(self):
+        """Returns the progress in a JSON-serializable form."""
+        return {"processed_ids": list(self.progress["processed_ids"])}
 
     def calculate_spam_score(self, entity):
         """Calculates a basic spam score (0-100) for an entity."""
-        score = 0
         name = entity.title if hasattr(entity, 'title') else (getattr(entity, 'first_name', '') or '')
         username = getattr(entity, 'username', '') or ''
+        # Lowercased once instead of twice per pattern
+        name, username = name.lower(), username.lower()
 
-        # Patterns common in spam bots
-        spam_patterns = ['crypto', 'invest', 'trading', 'profit', 'casino', 'bet', 'porn', 'sex', 'hot', 'free', 'money']
-
-        for pattern in spam_patterns:
-            if pattern in name.lower() or pattern in username.lower():
-                score += 30
+        score = 30 * sum(1 for pattern in SPAM_PATTERNS if pattern in name or pattern in username)
 
         # Random numbers in username often indicate bots
-        if any(c.isdigit() for c in username):
-            digits = sum(c.isdigit() for c in username)
-            if digits > 3:
-                score += 20
+        if sum(c.isdigit() for c in username) > 3:
+            score += 20
 
         return min(score, 100)
 
     async def analyze_activity(self, dialogs):
         """Analyzes dialogs for activity patterns."""
         now = datetime.now()
+        now_utc = datetime.now(timezone.utc) # Aware dates subtract correctly across time zones
         stats = {
             "inactive_7d": 0,
             "inactive_30d": 0,
@@ -215,7 +490,7 @@ class TelegramCleaner:
 
             # d.date is naive or utc? Telethon usually returns UTC aware
             if last_msg_date.tzinfo:
-                delta = (datetime.now(last_msg_date.tzinfo) - last_msg_date).days
+                delta = (now_utc - last_msg_date).days
             else:
                 delta = (now - last_msg_date).days
 
@@ -227,7 +502,7 @@ class TelegramCleaner:
 
     async def export_data(self, dialogs):
         """Exports a summary of dialogs to a JSON file before deletion."""
-        export_file = f"export_{self.session_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        export_file = f"export_{self.session_name}_{datetime.now().strftime(FILE_TIMESTAMP_FORMAT)}.json"
         data = []
         for d in dialogs:
             entity = d.entity
@@ -242,7 +517,8 @@ class TelegramCleaner:
             }
             data.append(item)
 
-        _atomic_write(export_file, data)
+        # The export covers every dialog, so write it off the event loop
+        await asyncio.to_thread(_atomic_write, export_file, data, dedupe=False)
         return export_file
 
     def estimate_duration(self, total_chats, whitelisted_chats):
@@ -263,150 +539,372 @@ class TelegramCleaner:
             return f"~{hours:.1f} hours"
 
     def _is_whitelisted(self, entity):
-        """Checks if an entity is in the whitelist and updates counts if it's the first time."""
+        """Checks if an entity is in the whitelist; the answer is cached per entity ID."""
+        cached = self._whitelisted.get(entity.id)
+        if cached is not None:
+            return cached
+
         is_kept = False
         # Check by ID
         if entity.id in self.whitelist_ids:
             is_kept = True
 
         # Check by username
-        if not is_kept and hasattr(entity, 'username') and entity.username:
-            if entity.username.lower() in self.whitelist_usernames:
+        if not is_kept:
+            username = getattr(entity, 'username', None)
+            if username and username.lower() in self.whitelist_usernames:
                 is_kept = True
 
         # Check by title (for channels/groups) or first_name/last_name (for users)
         if not is_kept:
-            name = ""
-            if hasattr(entity, 'title'):
-                name = entity.title
-            elif hasattr(entity, 'first_name'):
-                name = entity.first_name
-                if getattr(entity, 'last_name', None):
-                    name += f" {entity.last_name}"
-
-            if name and name in self.whitelist_titles:
+            getter = WHITELIST_NAME_GETTERS.get(type(entity))
+            # Types outside the table (ChannelForbidden, ChatForbidden) still match by title
+            name = getter(entity) if getter else getattr(entity, 'title', None)
+
+            if name and name.lower() in self.whitelist_titles:
                 is_kept = True
 
+        self._whitelisted[entity.id] = is_kept
         return is_kept
 
-    async def _process_dialog(self, entity, ignore_processed=False, semaphore=None):
-        """Processes a single dialog entity with concurrency control."""
-        sem = semaphore or self.semaphore
-        async with sem:
-            return await self._process_dialog_internal(entity, ignore_processed=ignore_processed)
-
-    async def _process_dialog_internal(self, entity, retry_count=0, ignore_processed=False):
-        """Internal logic for processing a single dialog entity."""
-        name = entity.title if hasattr(entity, 'title') else (getattr(entity, 'username', None) or f"ID: {entity.id}")
+    async def _process_dialog(self, entity, semaphore):
+        """Processes a single dialog entity under the caller's semaphore."""
+        async with semaphore:
+            return await self._process_dialog_internal(entity)
 
-        if not ignore_processed and entity.id in self.progress["processed_ids"]:
-            return True
+    async def _leave_channel(self, entity, name):
+        await self.client(LeaveChannelRequest(entity))
+        if getattr(entity, 'broadcast', False):
+            self.logs.channels_left += 1
+            await self.log_and_report(f"🚪 Left channel: {name}")
+        else:
+            self.logs.groups_left += 1
+            await self.log_and_report(f"🚪 Left group: {name}")
+
+    async def _block_bot(self, entity, name):
+        # Both requests go out together on the same connection instead of back to back
+        await asyncio.gather(
+            self.client(BlockRequest(entity.id)),
+            self.client.delete_dialog(entity, revoke=True),
+        )
+        self.logs.bots_blocked_deleted += 1
+        await self.log_and_report(f"⛔ Blocked and deleted bot: {name}")
+
+    async def _delete_private_chat(self, entity, name):
+        await self.client.delete_dialog(entity, revoke=True)
+        self.logs.private_chats_blocked_deleted += 1
+        await self.log_and_report(f"🗑️  Deleted private chat: {name}")
+
+    async def _skip_unknown(self, entity, name):
+        logger.warning("⚠️ Skipping unknown entity: %s", name)
+        self.logs.errors.append(f"Unknown entity: {name}")
+
+    def _action_for(self, entity):
+        """Picks the cleanup coroutine for an entity once, so retries skip the type dispatch."""
+        if isinstance(entity, Channel):
+            return self._leave_channel
+        if isinstance(entity, User):
+            return self._block_bot if entity.bot else self._delete_private_chat
+        return self._skip_unknown
+
+    def _classify(self, entity):
+        """Returns (display name, cleanup action) for an entity, computed once per entity ID."""
+        cached = self._classified.get(entity.id)
+        if cached is None:
+            name = entity.title if hasattr(entity, 'title') else (getattr(entity, 'username', None) or f"ID: {entity.id}")
+            cached = self._classified[entity.id] = (name, self._action_for(entity))
+        return cached
+
+    async def _process_dialog_internal(self, entity, limiter=None):
+        """
+        Internal logic for processing a single dialog entity.
+        Callers filter out already-processed entities before scheduling them.
+        """
+        entity_id = entity.id
+        name, action = self._classify(entity)
 
         if self._is_whitelisted(entity):
-            if name not in self.logs["skipped_items"]:
-                self.logs["skipped_items"].append(name)
+            if name not in self.logs.skipped_items:
+                self.logs.skipped_items.add(name)
                 await self.log_and_report(f"💎 [WHITELISTED] {name}")
-            self.progress["processed_ids"].append(entity.id)
+            self._mark_processed(entity_id)
             return True
 
-        # Adaptive Rate Limiting wait
-        await self.limiter.wait()
+        return await self._attempt_action(entity, entity_id, name, action, limiter or self.limiter)
 
-        try:
-            if isinstance(entity, Channel):
-                await self.client(LeaveChannelRequest(entity))
-                log_key = "channels_left" if getattr(entity, 'broadcast', False) else "groups_left"
-                self.logs[log_key] += 1
-                await self.log_and_report(f"🚪 Left {'channel' if log_key == 'channels_left' else 'group'}: {name}")
-            elif isinstance(entity, User):
-                if entity.bot:
-                    await self.client(BlockRequest(entity.id))
-                    await self.client.delete_dialog(entity, revoke=True)
-                    self.logs["bots_blocked_deleted"] += 1
-                    await self.log_and_report(f"⛔ Blocked and deleted bot: {name}")
-                else:
-                    await self.client.delete_dialog(entity, revoke=True)
-                    self.logs["private_chats_blocked_deleted"] += 1
-                    await self.log_and_report(f"🗑️  Deleted private chat: {name}")
-            else:
-                print(f"⚠️ Skipping unknown entity: {name}")
-                self.logs["errors"].append(f"Unknown entity: {name}")
+    async def _attempt_action(self, entity, entity_id, name, action, limiter):
+        """Runs a cleanup action; entity metadata is resolved once by the caller and reused on retries."""
+        for attempt in range(MAX_FLOOD_RETRIES + 1):
+            # Adaptive Rate Limiting wait
+            await limiter.wait()
 
-            self.progress["processed_ids"].append(entity.id)
-            self.limiter.cooldown() # Things are working well
-            return True
-        except errors.FloodWaitError as e:
-            self.limiter.backoff(e.seconds)
-            wait_time = e.seconds + 5
-            if retry_count < 7:
-                await self.log_and_report(f"⏳ [RATE LIMIT] Hit for {name}, waiting {wait_time}s...")
+            try:
+                await action(entity, name)
+
+                self._mark_processed(entity_id)
+                limiter.cooldown() # Things are working well
+                return True
+            except errors.FloodWaitError as e:
+                limiter.backoff(e.seconds)
+                if attempt == MAX_FLOOD_RETRIES:
+                    break
+                wait_time = limiter.retry_delay(e.seconds, attempt)
+                await self.log_and_report(f"⏳ [RATE LIMIT] Hit for {name}, waiting {wait_time:.0f}s...")
                 await asyncio.sleep(wait_time)
-                return await self._process_dialog_internal(entity, retry_count + 1, ignore_processed=ignore_processed)
-            else:
-                await self.log_and_report(f"❌ [FAILED] Max retries reached for {name}")
+            except Exception as e:
+                error = ERROR_PROCESSING % (name, e)
+                await self.log_and_report(f"⚠️ {error}")
+                self.logs.errors.append(error)
                 return False
-        except Exception as e:
-            await self.log_and_report(f"⚠️ Error processing {name}: {str(e)}")
-            self.logs["errors"].append(f"Error processing {name}: {str(e)}")
-            return False
+
+        await self.log_and_report(f"❌ [FAILED] Max retries reached for {name}")
+        return False
+
+    async def _pool_worker(self, index, queue, failed, limiter):
+        """Long-lived worker that drains the queue while its slot is within the limiter's concurrency."""
+        while True:
+            # Idle workers above the current concurrency until the limiter ramps back up
+            await limiter.acquire_slot(index)
+            entity = await queue.get()
+            try:
+                if not await self._process_dialog_internal(entity, limiter=limiter):
+                    failed.append(entity)
+            except Exception as e:
+                # Keep the worker alive; a dead worker would leave the queue undrained and the pool hung
+                logger.error(ERROR_PROCESSING, entity.id, e)
+                failed.append(entity)
+            finally:
+                queue.task_done()
+
+    async def _process_pool(self, entities, ignore_processed=False, report_progress=False, limiter=None, label=None):
+        """
+        Feeds entities to a fixed set of workers through a bounded queue.
+        A worker picks up the next chat as soon as it finishes, so a slow chat
+        never stalls a whole batch, and the queue bound gives backpressure.
+        Accepts a list or an async iterator, so dialogs can be processed while
+        later pages are still being fetched. Returns the entities that could not be processed.
+        """
+        limiter = limiter or self.limiter
+        prefix = f" ({label})" if label else ""
+        total = len(entities) if isinstance(entities, list) else None
+        processed_ids = self.progress["processed_ids"]
+        failed = []
+        queue = asyncio.Queue(maxsize=limiter.max_concurrency * 2)
+        workers = [
+            asyncio.create_task(self._pool_worker(index, queue, failed, limiter))
+            for index in range(limiter.max_concurrency)
+        ]
+        try:
+            i = 0
+            async for entity in _as_async_iter(entities):
+                if report_progress and total is not None and i % limiter.max_concurrency == 0:
+                    if self.progress_callback:
+                        # Use a more compact report for the bot to avoid spam
+                        percentage = int((i/total)*100) if total > 0 else 100
+                        await self.progress_callback(f"⏳ **Progress{prefix}:** {i}/{total} ({percentage}%) | **Speed:** {limiter.concurrency}x")
+                    else:
+                        logger.info("📦 Progress%s: %d/%d (Concurrency: %d)", prefix, i, total, limiter.concurrency)
+                i += 1
+
+                # Already-processed chats never reach a worker
+                if ignore_processed or entity.id not in processed_ids:
+                    await queue.put(entity)
+
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # Wait for them to unwind, so no request is still in flight once the pool returns
+            await asyncio.gather(*workers, return_exceptions=True)
+        return failed
+
+    async def _process_by_action(self, entities):
+        """
+        Groups entities by cleanup action and drains each group through its own
+        pool and limiter, so one request type backing off does not stall the others.
+        The per-action limiters pace through self.limiter, which caps their combined
+        rate and spreads FloodWait pauses account-wide.
+        Returns the entities that could not be processed.
+        """
+        plan = {}
+        for entity in entities:
+            plan.setdefault(self._classify(entity)[1], []).append(entity)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tasks = [
+                    tg.create_task(self._process_pool(
+                        group,
+                        report_progress=True,
+                        limiter=AdaptiveRateLimiter(
+                            max_concurrency=ACTION_CONCURRENCY.get(action.__name__, 1), parent=self.limiter
+                        ),
+                        label=ACTION_LABELS.get(action.__name__),
+                    ))
+                    for action, group in plan.items()
+                ]
+        except ExceptionGroup as eg:
+            # Callers report the error text, so surface the real failure rather than the group
+            raise _first_exception(eg) from eg
+        return [entity for task in tasks for entity in task.result()]
+
+    async def _dialog_total(self):
+        """Returns the number of dialogs on the account with a single limit=0 request."""
+        try:
+            return (await self.client.get_dialogs(limit=0)).total
+        except errors.FloodWaitError as e:
+            await asyncio.sleep(e.seconds + 5)
+            return (await self.client.get_dialogs(limit=0)).total
+
+    async def _verification_passes(self, failed, kept_count=0, passes=3):
+        """
+        Retries chats that failed, then always finishes with a dialog total check.
+        Only failed chats are retried; a full re-fetch is reserved for the last pass
+        and skipped when the dialog total shows only kept chats are left.
+        Returns that total when it is still current, so the summary can reuse it.
+        """
+        for pass_num in range(passes):
+            if pass_num == passes - 1:
+                total = await self._dialog_total()
+                if total <= kept_count:
+                    await self.log_and_report(f"✅ Verification Pass {pass_num + 1}: Clean!")
+                    return total
+                # Last pass: re-scan the account and retry leftovers as each page arrives
+                await self.log_and_report(f"🔍 Verification Pass {pass_num + 1}: Re-scanning remaining chats...")
+                failed = await self._process_pool(self._stream_remaining_entities(), ignore_processed=True)
+                if failed:
+                    await self.log_and_report(f"⚠️ Verification Pass {pass_num + 1}: {len(failed)} could not be removed.")
+                else:
+                    await self.log_and_report(f"✅ Verification Pass {pass_num + 1}: Clean!")
+                return None
+
+            remaining = failed
+            if not remaining:
+                # Nothing to retry, but chats skipped as processed by an earlier run still need the final check
+                continue
+
+            await self.log_and_report(f"⚠️ Verification Pass {pass_num + 1}: {len(remaining)} remain.")
+            # Only list first few to avoid spamming the bot chat
+            for entity in remaining[:5]:
+                name = getattr(entity, 'title', None) or getattr(entity, 'username', None) or f"ID: {entity.id}"
+                logger.info("  🚩 Remaining: %s", name)
+
+            await self.log_and_report(f"🔄 Retrying cleanup...")
+            failed = await self._process_pool(remaining, ignore_processed=True)
+            await asyncio.sleep(self.limiter.pass_gap())
+
+    async def _stream_dialog_entities(self):
+        """
+        Yields dialog entities page by page without keeping the Dialog wrappers around.
+        After a FloodWait the listing resumes from the last dialog, so callers may see an entity twice.
+        """
+        async for dialog in self._safe_iter_dialogs():
+            if dialog.entity:
+                yield dialog.entity
+
+    async def _stream_remaining_entities(self):
+        """Yields non-whitelisted dialog entities page by page."""
+        async for entity in self._stream_dialog_entities():
+            if not self._is_whitelisted(entity):
+                yield entity
+
+    async def _get_me(self):
+        """
+        Returns {"id", "username"} for the logged-in account. The answer is kept in
+        prefs, so later runs skip the users.getUsers round-trip; it is only reused
+        while the session's own cached user ID still matches.
+        """
+        me = self.prefs.get("me")
+        if me:
+            peer = await self.client.get_me(input_peer=True)
+            if peer and peer.user_id == me["id"]:
+                return me
+        user = await self.client.get_me()
+        if not user:
+            return None
+        me = self.prefs["me"] = {"id": user.id, "username": user.username}
+        return me
 
     async def _prepare_whitelist(self, user_kept_items):
         """Resolves whitelisted items to IDs, usernames, and titles."""
-        combined_items = set(self.prefs.get("kept_items", [])) | user_kept_items
+        # Normalize once so duplicates that only differ by whitespace collapse together
+        combined_items = frozenset(
+            str(item).strip() for item in (*self.prefs.get("kept_items", []), *user_kept_items)
+        ) - {""}
         await self.log_and_report(f"\n🧠 [INTELLIGENCE] Analyzing {len(combined_items)} whitelist items...")
 
+        # Built as local sets and frozen at the end, so repeated calls never mutate a frozenset
+        whitelist_ids = set(self.whitelist_ids)
+        whitelist_usernames = set(self.whitelist_usernames)
+        whitelist_titles = set(self.whitelist_titles)
+        to_resolve = {} # original item -> @username to look up
         for item in combined_items:
-            item = str(item).strip()
-            if not item:
-                continue
-
-            # print(f"📡 Resolving: {item}")
-            await asyncio.sleep(0.05)
-
             # If it's a numeric ID
-            if item.replace('-', '').isdigit():
-                self.whitelist_ids.add(int(item))
-                print(f"  ✅ Added by ID: {item}")
+            if WHITELIST_ID_RE.fullmatch(item):
+                whitelist_ids.add(int(item))
+                logger.info("  ✅ Added by ID: %s", item)
                 continue
 
             # If it looks like a username or link
-            if item.startswith("@") or 't.me/' in item:
-                clean_item = item
-                if 't.me/' in item:
-                    username = item.split('t.me/')[-1].split('/')[0].split('?')[0]
-                    clean_item = "@" + username
-
-                try:
-                    entity = await self.client.get_entity(clean_item)
-                    self.whitelist_ids.add(entity.id)
-                    if hasattr(entity, 'username') and entity.username:
-                        self.whitelist_usernames.add(entity.username.lower())
-                    print(f"  ✅ Added by Entity: {item} (ID: {entity.id})")
-                except Exception as e:
-                    print(f"  ⚠️ Resolution failed for {item}, will use string match.")
-                    self.whitelist_usernames.add(clean_item.lstrip("@").lower())
+            match = WHITELIST_USERNAME_RE.search(item)
+            if match:
+                to_resolve[item] = "@" + (match.group(1) or match.group(2))
             else:
                 # Treat as title or plain username
-                self.whitelist_titles.add(item)
-                self.whitelist_usernames.add(item.lower())
-                print(f"  ✅ Added by Name/Title: {item}")
+                whitelist_titles.add(item.lower())
+                whitelist_usernames.add(item.lower())
+                logger.info("  ✅ Added by Name/Title: %s", item)
 
-        self.prefs["kept_items"] = sorted(list(combined_items))
+        # Resolve usernames concurrently, a few at a time so long whitelists don't trip ResolveUsername limits
+        logger.debug("📡 Resolving: %s", ", ".join(to_resolve))
+        resolve_slots = asyncio.Semaphore(WHITELIST_RESOLVE_CONCURRENCY)
+
+        async def resolve(clean_item):
+            async with resolve_slots:
+                return await self.client.get_entity(clean_item)
+
+        results = await asyncio.gather(
+            *(resolve(clean_item) for clean_item in to_resolve.values()),
+            return_exceptions=True,
+        )
+        for (item, clean_item), entity in zip(to_resolve.items(), results):
+            if isinstance(entity, BaseException):
+                logger.warning("  ⚠️ Resolution failed for %s, will use string match.", item)
+                whitelist_usernames.add(clean_item.lstrip("@").lower())
+                continue
+            whitelist_ids.add(entity.id)
+            if hasattr(entity, 'username') and entity.username:
+                whitelist_usernames.add(entity.username.lower())
+            logger.info("  ✅ Added by Entity: %s (ID: %s)", item, entity.id)
+
+        self.prefs["kept_items"] = set(combined_items)
+        # Only looked up from here on
+        self.whitelist_ids = frozenset(whitelist_ids)
+        self.whitelist_usernames = frozenset(whitelist_usernames)
+        self.whitelist_titles = frozenset(whitelist_titles)
+        self._whitelisted.clear()
 
     async def _safe_iter_dialogs(self):
-        """Iterates through dialogs with rate limit protection."""
-        dialogs = []
-        try:
-            async for dialog in self.client.iter_dialogs(limit=None):
-                dialogs.append(dialog)
-                # Small jittered sleep during iteration to avoid flooding on large accounts
-                if len(dialogs) % 20 == 0:
-                    await asyncio.sleep(0.5 + random.random() * 0.5)
-            return dialogs
-        except errors.FloodWaitError as e:
-            print(f"⏳ Rate limit hit fetching chats, waiting {e.seconds + 5} seconds...")
-            await asyncio.sleep(e.seconds + 5)
-            return await self._safe_iter_dialogs()
+        """
+        Yields dialogs with rate limit protection, waiting out FloodWaits in place.
+        After a FloodWait the listing resumes from the last dialog, so callers may see one twice.
+        """
+        offsets = {}
+        while True:
+            try:
+                async for dialog in self.client.iter_dialogs(limit=None, **offsets):
+                    yield dialog
+                    # Pinned dialogs come first out of date order, so only later ones mark a resume point
+                    if not dialog.pinned and dialog.message:
+                        offsets = {
+                            "offset_date": dialog.date,
+                            "offset_id": dialog.message.id,
+                            "offset_peer": dialog.input_entity,
+                        }
+                return
+            except errors.FloodWaitError as e:
+                logger.warning("⏳ Rate limit hit fetching chats, waiting %d seconds...", e.seconds + 5)
+                await asyncio.sleep(e.seconds + 5)
 
     async def run_cleanup(self, user_kept_items):
         """
@@ -414,68 +912,74 @@ class TelegramCleaner:
         Args:
             user_kept_items (set): A set of usernames, links, or names to keep.
         """
-        self._load_data()
+        await self._load_data_async()
+        # A cleaner can run several cleanups (bot sessions); don't overwrite the last run's log or carry its counters
+        self._start_run_log()
 
         await self.log_and_report("\n🚀 [INITIATING] Starting intelligent cleanup sequence...")
 
         # CLEAR OLD COUNTS FOR FRESH RUN
         self.whitelist_counts = {"channels": 0, "groups": 0, "bots": 0, "users": 0}
 
-        # Always whitelist self (Saved Messages)
-        try:
-            me = await self.client.get_me()
-            if me:
-                self.whitelist_ids.add(me.id)
-                self.system_whitelist_ids.add(me.id)
-                if me.username:
-                    self.whitelist_usernames.add(me.username.lower())
-                await self.log_and_report(f"🛡️  [SECURE] Whitelisted your account (Saved Messages)")
-
-            # PROTECT THE BOT ITSELF
-            bot_me = await self.client.get_me() # This client's me is the userbot, wait.
-            # No, I need the ID of the bot Lisa Kenny is talking to.
-            # That's already passed via the bot_interface.py
-        except errors.FloodWaitError as e:
-            await self.log_and_report(f"⏳ Rate limit hit checking identity, waiting {e.seconds + 5}s...")
-            await asyncio.sleep(e.seconds + 5)
-            return await self.run_cleanup(user_kept_items)
+        # Always whitelist self (Saved Messages); on FloodWait retry just the lookup, not the whole run
+        while True:
+            try:
+                me = await self._get_me()
+                break
+            except errors.FloodWaitError as e:
+                await self.log_and_report(f"⏳ Rate limit hit checking identity, waiting {e.seconds + 5}s...")
+                await asyncio.sleep(e.seconds + 5)
+        # The whitelist sets may be frozen by an earlier _prepare_whitelist, so extend them with |=
+        if me:
+            self.whitelist_ids |= {me["id"]}
+            self.system_whitelist_ids.add(me["id"])
+            if me["username"]:
+                self.whitelist_usernames |= {me["username"].lower()}
+            await self.log_and_report(f"🛡️  [SECURE] Whitelisted your account (Saved Messages)")
+        # The bot protecting itself is handled by bot_interface.py
 
         # Always whitelist Telegram service notifications
-        self.whitelist_ids.add(777000)
+        self.whitelist_ids |= {777000}
         self.system_whitelist_ids.add(777000)
 
         # PROTECT THE BOT ITSELF IF RUNNING IN BOT MODE
         # (This is a safety double-check)
         await self._prepare_whitelist(user_kept_items)
-        self._save_data() # Persist the updated whitelist immediately
+        await self._save_data_async() # Persist the updated whitelist immediately
 
         # --- Fetch Dialogs and Update Whitelist Counts ---
         await self.log_and_report("\n📊 [ANALYZING] Scanning your Telegram account...")
-        dialogs = await self._safe_iter_dialogs()
-
+        # Keep only the entities, split by whitelist status, keyed by ID to absorb dialogs repeated after a FloodWait
+        whitelisted = {}
+        to_clean = {}
         try:
-            for dialog in dialogs:
-                entity = dialog.entity
+            async for entity in self._stream_dialog_entities():
                 if self._is_whitelisted(entity):
-                    if isinstance(entity, Channel):
-                        if getattr(entity, 'broadcast', False):
-                            self.whitelist_counts["channels"] += 1
-                        else:
-                            self.whitelist_counts["groups"] += 1
-                    elif isinstance(entity, User):
-                        if entity.bot:
-                            self.whitelist_counts["bots"] += 1
-                        else:
-                            self.whitelist_counts["users"] += 1
-
+                    whitelisted[entity.id] = entity
+                else:
+                    to_clean[entity.id] = entity
+
+            for entity in whitelisted.values():
+                if isinstance(entity, Channel):
+                    if getattr(entity, 'broadcast', False):
+                        self.whitelist_counts["channels"] += 1
+                    else:
+                        self.whitelist_counts["groups"] += 1
+                elif isinstance(entity, User):
+                    if entity.bot:
+                        self.whitelist_counts["bots"] += 1
+                    else:
+                        self.whitelist_counts["users"] += 1
+
+            total_chats = len(whitelisted) + len(to_clean)
             total_whitelisted = sum(self.whitelist_counts.values())
-            est_time = self.estimate_duration(len(dialogs), total_whitelisted)
+            est_time = self.estimate_duration(total_chats, total_whitelisted)
 
             report = (
                 f"\n📈 [REPORT] Scan Complete:\n"
-                f"  - Total Chats Found: {len(dialogs)}\n"
+                f"  - Total Chats Found: {total_chats}\n"
                 f"  - Whitelisted Items: {total_whitelisted}\n"
-                f"  - Items to Remove: {len(dialogs) - total_whitelisted}\n"
+                f"  - Items to Remove: {total_chats - total_whitelisted}\n"
                 f"  - ⏳ Estimated Time: **{est_time}**\n\n"
                 f"  (Whitelisted: {self.whitelist_counts['channels']} Ch, {self.whitelist_counts['groups']} Gr, {self.whitelist_counts['bots']} Bt, {self.whitelist_counts['users']} Us)"
             )
@@ -483,122 +987,86 @@ class TelegramCleaner:
 
         except Exception as e:
             await self.log_and_report(f"❌ Error fetching chats: {str(e)}")
-            self.logs["errors"].append(f"Error fetching chats: {str(e)}")
-            self._save_data()
+            self.logs.errors.append(f"Error fetching chats: {str(e)}")
+            await self._save_data_async()
             return
 
         await self.log_and_report("\n⏳ Starting cleanup in 5 seconds...")
         await asyncio.sleep(5)
 
-        # --- Process in Smart Batches ---
-        # First, quickly process whitelisted items in parallel (no delay needed)
-        whitelisted_in_batch = [d for d in dialogs if self._is_whitelisted(d.entity)]
-        non_whitelisted = [d for d in dialogs if not self._is_whitelisted(d.entity)]
-
-        if whitelisted_in_batch:
-            await self.log_and_report(f"⚡ Fast-tracking {len(whitelisted_in_batch)} whitelisted items...")
-            fast_sem = asyncio.Semaphore(10) # High concurrency for non-destructive whitelist skips
-            tasks = [self._process_dialog(d.entity, semaphore=fast_sem) for d in whitelisted_in_batch]
-            await asyncio.gather(*tasks)
-
-        # Then, process destructive actions with adaptive concurrency
-        await self.log_and_report(f"🧹 Starting destructive cleanup for {len(non_whitelisted)} items...")
-
-        i = 0
-        total = len(non_whitelisted)
-        while i < total:
-            # Use current dynamic concurrency from limiter
-            batch_size = self.limiter.concurrency
-            batch = non_whitelisted[i : i + batch_size]
-
-            # Report progress every batch
-            if self.progress_callback:
-                # Use a more compact report for the bot to avoid spam
-                percentage = int((i/total)*100) if total > 0 else 100
-                await self.progress_callback(f"⏳ **Progress:** {i}/{total} ({percentage}%) | **Speed:** {batch_size}x")
-            else:
-                print(f"📦 Progress: {i}/{total} (Concurrency: {batch_size})")
-
-            # Create a temporary semaphore for this batch's concurrency
-            batch_sem = asyncio.Semaphore(batch_size)
-            tasks = [self._process_dialog(d.entity, semaphore=batch_sem) for d in batch]
-            await asyncio.gather(*tasks)
-
-            _atomic_write(self.progress_file, self.progress)
-            i += batch_size
-
-            # Dynamic gap between batches
-            await asyncio.sleep(1 + random.random())
-
-        # --- Verification Passes ---
-        for pass_num in range(3):
-            # Refresh the internal dialog cache with safety
-            try:
-                await self.client.get_dialogs(limit=None)
-            except errors.FloodWaitError as e:
-                await asyncio.sleep(e.seconds + 5)
-
-            all_dialogs = await self._safe_iter_dialogs()
-            remaining_dialogs = [d for d in all_dialogs if not self._is_whitelisted(d.entity)]
+        # Progress is flushed by a background task instead of after every batch
+        flusher = asyncio.create_task(self._progress_flusher())
+        try:
+            # --- Process in Smart Batches ---
+            # First, quickly process whitelisted items in parallel (no delay needed)
+            if whitelisted:
+                await self.log_and_report(f"⚡ Fast-tracking {len(whitelisted)} whitelisted items...")
+                fast_sem = asyncio.Semaphore(10) # High concurrency for non-destructive whitelist skips
+                try:
+                    async with asyncio.TaskGroup() as tg:
+                        for entity in whitelisted.values():
+                            if entity.id not in self.progress["processed_ids"]:
+                                tg.create_task(self._process_dialog(entity, semaphore=fast_sem))
+                except ExceptionGroup as eg:
+                    raise _first_exception(eg) from eg
 
-            if not remaining_dialogs:
-                await self.log_and_report(f"✅ Verification Pass {pass_num + 1}: Clean!")
-                break
+            # Then, process destructive actions with adaptive concurrency
+            await self.log_and_report(f"🧹 Starting destructive cleanup for {len(to_clean)} items...")
 
-            await self.log_and_report(f"⚠️ Verification Pass {pass_num + 1}: {len(remaining_dialogs)} remain.")
-            # Only list first few to avoid spamming the bot chat
-            for d in remaining_dialogs[:5]:
-                name = d.name if d.name else (getattr(d.entity, 'title', None) or getattr(d.entity, 'username', None) or f"ID: {d.id}")
-                print(f"  🚩 Remaining: {name}")
+            failed = await self._process_by_action(to_clean.values())
 
-            await self.log_and_report(f"🔄 Retrying cleanup...")
-            tasks = [self._process_dialog(d.entity, ignore_processed=True) for d in remaining_dialogs if d.entity]
-            await asyncio.gather(*tasks)
-            _atomic_write(self.progress_file, self.progress)
-            await asyncio.sleep(5)
+            remaining_total = await self._verification_passes(failed, kept_count=len(whitelisted))
+        finally:
+            flusher.cancel()
+            self._flush_progress()
 
         # --- Final Summary ---
-        final_dialogs = await self._safe_iter_dialogs()
-        self.logs["remaining_chats"] = len(final_dialogs)
+        # limit=0 asks Telegram for the total only, without paginating every dialog
+        if remaining_total is None:
+            remaining_total = await self._dialog_total()
+        self.logs.remaining_chats = remaining_total
 
         # Calculate user whitelisted items only for the summary report
-        # Filter out system protection names
-        system_names = ["Saved Messages", "Telegram", "ID: 777000"]
-        user_skipped = [name for name in self.logs["skipped_items"]
-                       if name not in system_names and not any(sn in name for sn in system_names)]
+        # Filter out system protection names; only the count is reported
+        user_skipped = sum(1 for name in self.logs.skipped_items if not SYSTEM_NAME_RE.search(name))
 
         summary = (
             f"\n🏆 [MISSION COMPLETE] Final Summary:\n"
-            f"  🚪 Channels Left: {self.logs['channels_left']}\n"
-            f"  🚪 Groups Left: {self.logs['groups_left']}\n"
-            f"  ⛔ Bots Blocked/Deleted: {self.logs['bots_blocked_deleted']}\n"
-            f"  🗑️  Private Chats Deleted: {self.logs['private_chats_blocked_deleted']}\n"
-            f"  💎 Whitelist Preserved: {len(user_skipped)}\n"
-            f"  🛡️  System Protected: {len(self.logs['skipped_items']) - len(user_skipped)}\n"
-            f"  ⚠️ Errors: {len(self.logs['errors'])}\n"
-            f"  📊 Remaining Chats: {self.logs['remaining_chats']}"
+            f"  🚪 Channels Left: {self.logs.channels_left}\n"
+            f"  🚪 Groups Left: {self.logs.groups_left}\n"
+            f"  ⛔ Bots Blocked/Deleted: {self.logs.bots_blocked_deleted}\n"
+            f"  🗑️  Private Chats Deleted: {self.logs.private_chats_blocked_deleted}\n"
+            f"  💎 Whitelist Preserved: {user_skipped}\n"
+            f"  🛡️  System Protected: {len(self.logs.skipped_items) - user_skipped}\n"
+            f"  ⚠️ Errors: {len(self.logs.errors)}\n"
+            f"  📊 Remaining Chats: {self.logs.remaining_chats}"
         )
         await self.log_and_report(summary)
 
-        self._save_data()
+        await self._save_data_async()
 
 async def main():
     """Example usage of the TelegramCleaner SDK."""
     try:
-        from .config import load_config
+        from .config import configure_logging, load_config
     except ImportError:
-        from config import load_config
+        from config import configure_logging, load_config
+    configure_logging()
     config = load_config()
 
     cleaner = TelegramCleaner(config)
     await cleaner.connect()
 
     user_input = input("📝 Enter bots to keep (comma-separated): ")
-    kept_bots = {b.strip().lower() for b in user_input.split(",") if b.strip()}
+    kept_bots = frozenset(b.strip() for b in user_input.split(",") if b.strip())
 
     await cleaner.run_cleanup(kept_bots)
     await cleaner.disconnect()
 
 if __name__ == "__main__":
     # This allows the SDK to be tested independently.
-    asyncio.run(main())
+    try:
+        from .config import run_async
+    except ImportError:
+        from config import run_async
+    run_async(main())
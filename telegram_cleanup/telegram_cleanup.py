@@ -1,9 +1,9 @@
-import asyncio
-from .config import load_config
+from .config import configure_logging, load_config, run_async
 from .sdk import TelegramCleaner
 
 def main_cli():
     """Command-line interface for the Telegram Cleanup script."""
+    configure_logging()
     config = load_config()
 
     if not config.get("phone"):
@@ -33,7 +33,7 @@ def main_cli():
         await cleaner.disconnect()
 
     try:
-        asyncio.run(run())
+        run_async(run())
     except KeyboardInterrupt:
         print("👋 Exiting...")
     except Exception as e: